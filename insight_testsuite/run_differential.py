@@ -0,0 +1,571 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+GRADER_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(GRADER_ROOT, '..', 'src'))
+
+from anomaly_detection import browse_data, build_history, friend_network
+from backtest import backtest, load_base, save_base
+from export import ColumnarStore, export, import_pyarrow
+from hubs import HubAwareEngine
+from journal import JOURNAL_FILE, journaled_browse, recover
+from shard import ShardedGraph, community_partition
+from shared_store import SharedGraphWriter, required_size
+from synthetic import generate_events, write_log
+from tenant import PartitionedEngine
+
+BASELINE = os.path.join(GRADER_ROOT, 'perf_baseline.json')
+# Megabytes an engine holds outside this process, in child processes or
+# shared memory segments, which tracemalloc does not see. Engines add to it
+# and measure reads it.
+OUTSIDE_MEMORY = []
+
+def reference(batch, stream, D, T):
+    """
+    The plain engine of anomaly_detection, which every other engine must
+    match.
+    """
+    people_list, last_order = build_history(batch)
+    _, anomaly_list = browse_data(people_list, stream, D, T, last_order + 1)
+    return anomaly_list
+
+def journal_engine(batch, stream, D, T, commit_interval=16,
+                   checkpoint_interval=100):
+    # Small intervals by default, so that checkpoints and fsyncs happen in
+    # each case.
+    journal_dir = tempfile.mkdtemp()
+    try:
+        people_list, last_order = build_history(batch)
+        _, anomaly_list = journaled_browse(
+            people_list, stream, D, T, last_order + 1, journal_dir,
+            commit_interval, checkpoint_interval)
+        return anomaly_list
+    finally:
+        shutil.rmtree(journal_dir)
+
+class Crash(Exception):
+    pass
+
+class CrashingStream(dict):
+    """
+    A stream that crashes the run when it reaches the event at crash_at.
+    """
+    def __init__(self, data, crash_at):
+        dict.__init__(self, data)
+        self.crash_at = crash_at
+
+    def __getitem__(self, i):
+        if i == self.crash_at:
+            raise Crash(i)
+        return dict.__getitem__(self, i)
+
+def journal_restart_engine(batch, stream, D, T, after_checkpoint=False):
+    """
+    Crash a journaled run at a random event, tear the end of its journal,
+    and resume it in the same directory.
+
+    The crash comes before the first checkpoint of the run, or after at
+    least one of them with after_checkpoint.
+    """
+    if not stream:
+        return journal_engine(batch, stream, D, T)
+    rng = random.Random(len(batch) * 1009 + len(stream) * 31 + D * 7 + T)
+    crash_at = rng.choice(sorted(stream))
+    if after_checkpoint:
+        checkpoint_interval = rng.randint(1, max(1, crash_at))
+    else:
+        checkpoint_interval = crash_at + 1
+    journal_dir = tempfile.mkdtemp()
+    try:
+        people_list, last_order = build_history(batch)
+        try:
+            journaled_browse(people_list, CrashingStream(stream, crash_at),
+                             D, T, last_order + 1, journal_dir, 4,
+                             checkpoint_interval)
+        except Crash:
+            pass
+        # The header and the records of fsynced groups survive. Of the
+        # records after them, lose some and tear the next one, as a crash in
+        # the middle of a write does.
+        journal_path = os.path.join(journal_dir, JOURNAL_FILE)
+        with open(journal_path, 'rb') as jf:
+            records = jf.readlines()
+        kept = len(records) - (len(records) - 1) % 4
+        kept += rng.randint(0, len(records) - kept)
+        with open(journal_path, 'wb') as jf:
+            jf.writelines(records[:kept])
+            if kept < len(records):
+                jf.write(records[kept][:rng.randrange(len(records[kept]))])
+
+        people_list, last_order = build_history(batch)
+        _, anomaly_list = journaled_browse(
+            people_list, stream, D, T, last_order + 1, journal_dir, 4,
+            checkpoint_interval)
+        return anomaly_list
+    finally:
+        shutil.rmtree(journal_dir)
+
+def journal_rerun_engine(batch, stream, D, T):
+    """
+    Finish a journaled run on other events, then run the case in the same
+    directory, which must start over instead of resuming.
+    """
+    journal_dir = tempfile.mkdtemp()
+    try:
+        other = generate_events(len(stream) + 5, 10, len(batch))
+        people_list, last_order = build_history(other)
+        journaled_browse(people_list, other, 1, 2, last_order + 1,
+                         journal_dir, 4, 3)
+        people_list, last_order = build_history(batch)
+        _, anomaly_list = journaled_browse(
+            people_list, stream, D, T, last_order + 1, journal_dir, 4, 3)
+        return anomaly_list
+    finally:
+        shutil.rmtree(journal_dir)
+
+def tenant_engine(batch, stream, D, T):
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        # A tiny budget, so that the tenant is compacted all the time.
+        engine = PartitionedEngine(snapshot_dir, tenant_budget=1, quantum=7)
+        engine.add_tenant('merchant', D, T, batch)
+        engine.submit('merchant', stream)
+        return engine.run()['merchant']
+    finally:
+        shutil.rmtree(snapshot_dir)
+
+def many_tenant_engine(batch, stream, D, T):
+    """
+    Run the case as three tenants among noise tenants, on several workers,
+    with every idle tenant evicted. The stream comes in two runs, so the
+    second one reloads every tenant from its snapshot.
+    """
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+        engine = PartitionedEngine(snapshot_dir, tenant_budget=50,
+                                   total_budget=1, idle_timeout=0,
+                                   quantum=5, workers=3)
+        cases = ['case_a', 'case_b', 'case_c']
+        noise = {}
+        for seed, tenant_ID in enumerate(['noise_a', 'noise_b']):
+            events = generate_events(len(batch) + len(stream) + 10, 20,
+                                     seed + len(batch))
+            half = len(events) // 2
+            noise[tenant_ID] = dict((i - half, events[i])
+                                    for i in range(half, len(events)))
+            engine.add_tenant(tenant_ID, 2, 5,
+                              dict((i, events[i]) for i in range(half)))
+        for tenant_ID in cases:
+            engine.add_tenant(tenant_ID, D, T, batch)
+
+        split = len(stream) // 2
+        for part in [lambda i: i < split, lambda i: i >= split]:
+            for tenant_ID in cases:
+                engine.submit(tenant_ID, dict(
+                    (i, event) for i, event in stream.items() if part(i)))
+            for tenant_ID, events in noise.items():
+                engine.submit(tenant_ID, dict(
+                    (i, event) for i, event in events.items() if part(i)))
+            anomaly = engine.run()
+        if engine.evictions == 0:
+            return 'no tenant was evicted'
+        flags = [anomaly[tenant_ID] for tenant_ID in cases]
+        if flags.count(flags[0]) != len(flags):
+            return 'tenants of the same case differ'
+        return flags[0]
+    finally:
+        shutil.rmtree(snapshot_dir)
+
+def read_flags(output_dir):
+    """
+    The flags of the only stream log of a backtest.
+    """
+    name, = os.listdir(output_dir)
+    with open(os.path.join(output_dir, name)) as result:
+        return [line for line in result.read().split('\n') if line]
+
+def backtest_snapshot_engine(batch, stream, D, T):
+    """
+    Save the history of the batch to a snapshot, and backtest the stream
+    from it.
+    """
+    work_dir = tempfile.mkdtemp()
+    try:
+        batch_log = os.path.join(work_dir, 'batch_log.json')
+        stream_log = os.path.join(work_dir, 'stream_log.json')
+        snapshot = os.path.join(work_dir, 'history.json')
+        output_dir = os.path.join(work_dir, 'flagged')
+        write_log(batch_log, batch, D, T)
+        write_log(stream_log, stream)
+        save_base(load_base(batch_log), snapshot)
+        backtest(load_base(snapshot=snapshot), [stream_log], 1, output_dir)
+        return read_flags(output_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+def backtest_journal_engine(batch, stream, D, T):
+    """
+    Crash a journaled run in the middle of the stream, and backtest the rest
+    of the stream from its journal directory.
+    """
+    if not stream:
+        return backtest_snapshot_engine(batch, stream, D, T)
+    work_dir = tempfile.mkdtemp()
+    try:
+        journal_dir = os.path.join(work_dir, 'journal')
+        people_list, last_order = build_history(batch)
+        try:
+            journaled_browse(
+                people_list, CrashingStream(stream, len(stream) // 2), D, T,
+                last_order + 1, journal_dir, 4, max(1, len(stream) // 5))
+        except Crash:
+            pass
+        flags = recover(journal_dir)['flags']
+
+        base = load_base(snapshot=journal_dir)
+        first = base['initial_order'] - last_order - 1
+        stream_log = os.path.join(work_dir, 'stream_log.json')
+        output_dir = os.path.join(work_dir, 'flagged')
+        write_log(stream_log, dict((i - first, stream[i])
+                                   for i in range(first, len(stream))))
+        backtest(base, [stream_log], 1, output_dir)
+        return flags + read_flags(output_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+# The columns a Parquet export must read back exactly like the raw arrays.
+STORE_COLUMNS = ['ids', 'friend_offset', 'friend', 'purchase_offset', 'amount',
+                 'index', 'timestamp', 'spent']
+
+def check_store(store, people_list, D):
+    """
+    Compare every query of a ColumnarStore with people_list.
+
+    Returns
+    -------
+    mismatch: str
+        What differs, or None if nothing does.
+    """
+    degrees = {}
+    for person_ID, person in people_list.items():
+        degrees[len(person.friend)] = degrees.get(len(person.friend), 0) + 1
+    if store.degree_counts() != degrees:
+        return 'degree_counts differs'
+
+    spent = dict((person_ID, sum(purchase.amount
+                                 for purchase in person.purchase))
+                 for person_ID, person in people_list.items())
+    for person_ID, person in people_list.items():
+        if store.degree(person_ID) != len(person.friend):
+            return 'degree of {} differs'.format(person_ID)
+
+        amount = [purchase.amount for purchase in person.purchase]
+        stats = {'count': 0, 'total': 0, 'mean': 0, 'min': 0, 'max': 0}
+        if amount:
+            stats = {'count': len(amount), 'total': spent[person_ID],
+                     'mean': spent[person_ID] / len(amount),
+                     'min': min(amount), 'max': max(amount)}
+        if store.purchase_stats(person_ID) != stats:
+            return 'purchase_stats of {} differs'.format(person_ID)
+
+        network = friend_network(person, people_list, D)
+        if set(store.ids[code]
+               for code in store.network(person_ID, D)) != network:
+            return 'network of {} differs'.format(person_ID)
+
+        # ids are sorted, so the lowest code is the lowest id.
+        top = sorted(network, key=lambda friend_ID: (-spent[friend_ID],
+                                                     friend_ID))[:3]
+        if store.top_spenders(person_ID, D, 3) != [
+                (friend_ID, spent[friend_ID]) for friend_ID in top]:
+            return 'top_spenders of {} differs'.format(person_ID)
+
+    unknown = 'unknown'
+    while unknown in people_list:
+        unknown += '_'
+    if (store.degree(unknown) != 0 or store.network(unknown, D)
+            or store.top_spenders(unknown, D) != []
+            or store.purchase_stats(unknown)['count'] != 0):
+        return 'queries on an unknown id differ'
+    return None
+
+def export_engine(batch, stream, D, T):
+    """
+    Export people_list after the stream, and check the queries of the export
+    against people_list. The Parquet export must read back the same columns,
+    when pyarrow is installed.
+    """
+    people_list, last_order = build_history(batch)
+    _, anomaly_list = browse_data(people_list, stream, D, T, last_order + 1)
+    out_dir = tempfile.mkdtemp()
+    try:
+        export(people_list, os.path.join(out_dir, 'array'), 'array')
+        store = ColumnarStore(os.path.join(out_dir, 'array'))
+        mismatch = check_store(store, people_list, D)
+        if mismatch:
+            return mismatch
+        if import_pyarrow() is not None:
+            export(people_list, os.path.join(out_dir, 'parquet'), 'parquet')
+            parquet = ColumnarStore(os.path.join(out_dir, 'parquet'))
+            for column in STORE_COLUMNS:
+                if list(getattr(parquet, column)) != list(getattr(store,
+                                                                  column)):
+                    return 'parquet column {} differs'.format(column)
+        return anomaly_list
+    finally:
+        shutil.rmtree(out_dir)
+
+def shard_engine(batch, stream, D, T, num_shards=3, community=False):
+    partition = None
+    if community:
+        partition = community_partition(batch, num_shards)
+    graph = ShardedGraph(num_shards, partition)
+    try:
+        last_order = graph.build_history(batch)
+        anomaly_list = graph.browse_data(stream, D, T, last_order + 1)
+        OUTSIDE_MEMORY.extend(graph.memory())
+        return anomaly_list
+    finally:
+        graph.close()
+
+def shared_engine(batch, stream, D, T):
+    capacity, edge_capacity, id_bytes = required_size(batch, stream)
+    graph = SharedGraphWriter(capacity, edge_capacity, T, id_bytes)
+    OUTSIDE_MEMORY.append(graph.shm.size / 2 ** 20)
+    try:
+        last_order = graph.build_history(batch)
+        return graph.browse_data(stream, D, last_order + 1)
+    finally:
+        graph.unlink()
+
+def hub_engine(batch, stream, D, T):
+    # A low threshold, so that small cases have hubs too.
+    engine = HubAwareEngine(D, T, hub_degree=3)
+    last_order = engine.build_history(batch)
+    return engine.browse_data(stream, last_order + 1)
+
+ENGINES = {
+    'backtest_journal': backtest_journal_engine,
+    'backtest_snapshot': backtest_snapshot_engine,
+    'export': export_engine,
+    'hubs': hub_engine,
+    'journal': journal_engine,
+    'journal_rerun': journal_rerun_engine,
+    'journal_restart': journal_restart_engine,
+    'journal_restart_checkpoint':
+        lambda *args: journal_restart_engine(*args, after_checkpoint=True),
+    'tenant': tenant_engine,
+    'tenant_many': many_tenant_engine,
+    'shard': shard_engine,
+    'shard_community': lambda *args: shard_engine(*args, community=True),
+    'shared': shared_engine,
+}
+# Engines timed differently from how they are checked. The journal is timed
+# at the default intervals of journal.py, as it runs in production.
+TIMED = {
+    'journal': lambda *args: journal_engine(*args, commit_interval=64,
+                                            checkpoint_interval=10000),
+}
+# Engines whose time is mostly a crash, a restart or an earlier run, so they
+# are only checked for equivalence.
+UNTIMED = set(['backtest_journal', 'backtest_snapshot', 'export',
+               'journal_rerun', 'journal_restart',
+               'journal_restart_checkpoint', 'tenant_many'])
+
+def random_case(rng):
+    """
+    Draw the parameters and events of one random case.
+
+    Returns
+    -------
+    case: dict
+        key: 'D', 'T', 'batch', 'stream', and 'params', the parameters
+        that reproduce it.
+    """
+    params = {'seed': rng.randrange(2 ** 31),
+              'num_events': rng.randrange(1, 400),
+              'num_people': rng.choice([2, 3, 5, 10, 30, 100]),
+              'purchase_ratio': rng.choice([0.2, 0.5, 0.8]),
+              'unfriend_ratio': rng.choice([0, 0.05, 0.2]),
+              'D': rng.randrange(1, 4),
+              'T': rng.randrange(2, 12)}
+    params['num_batch'] = rng.randrange(params['num_events'] + 1)
+    return make_case(params)
+
+def make_case(params):
+    events = generate_events(params['num_events'], params['num_people'],
+                             params['seed'], params['purchase_ratio'],
+                             min(params['unfriend_ratio'],
+                                 1 - params['purchase_ratio']))
+    num_batch = params['num_batch']
+    batch = dict((i, events[i]) for i in range(num_batch))
+    stream = dict((i - num_batch, events[i])
+                  for i in range(num_batch, len(events)))
+    return {'D': params['D'], 'T': params['T'], 'batch': batch,
+            'stream': stream, 'params': params}
+
+def check_equivalence(num_cases, seed, engines):
+    """
+    Run every engine on random cases and compare their flags with the
+    reference.
+
+    Returns
+    -------
+    failures: list
+        A list of strings that describe the mismatches.
+    """
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(num_cases):
+        case = random_case(rng)
+        args = (case['batch'], case['stream'], case['D'], case['T'])
+        expected = reference(*args)
+        for name in engines:
+            try:
+                anomaly_list = ENGINES[name](*args)
+            except Exception as error:
+                anomaly_list = '{}: {}'.format(type(error).__name__, error)
+            if anomaly_list != expected:
+                failures.append('{} differs on {}'.format(
+                    name, json.dumps(case['params'], sort_keys=True)))
+    return failures
+
+def measure(engine, args, repeat=5, trace=True):
+    """
+    Time an engine, then trace the peak memory it allocates in this process.
+    Tracing slows python down, so it is kept out of the timing.
+
+    Returns
+    -------
+    seconds: float
+        The best time spent by the engine out of repeat runs.
+    peak: float
+        The peak of traced memory in this process, in megabytes, None
+        without trace.
+    outside: float
+        The peak resident memory of child processes plus the size of shared
+        memory segments, in megabytes, None without trace. Resident memory
+        also counts the python interpreter of every child.
+    """
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        engine(*args)
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    if not trace:
+        return seconds, None, None
+    del OUTSIDE_MEMORY[:]
+    tracemalloc.start()
+    engine(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 2 ** 20, sum(OUTSIDE_MEMORY)
+
+def check_performance(engines, threshold, update, rounds):
+    """
+    Measure every engine on a fixed workload, and compare its speed relative
+    to the reference with the recorded baseline.
+
+    Every round times the reference and then every engine, and the speed of
+    an engine is its median over the rounds, so one slow moment of the
+    machine does not fail the gate. Relative speed does not depend much on
+    the machine, so one baseline works everywhere.
+
+    Returns
+    -------
+    failures: list
+        A list of strings that describe the regressions.
+    """
+    case = make_case({'seed': 7, 'num_events': 6000, 'num_people': 500,
+                      'purchase_ratio': 0.6, 'unfriend_ratio': 0.05,
+                      'num_batch': 3000, 'D': 2, 'T': 50})
+    args = (case['batch'], case['stream'], case['D'], case['T'])
+    timed = [name for name in engines if name not in UNTIMED]
+    seconds = dict((name, []) for name in ['reference'] + timed)
+    speeds = dict((name, []) for name in timed)
+    memory = {}
+    for round_number in range(rounds):
+        trace = round_number == 0
+        reference_seconds, peak, outside = measure(reference, args,
+                                                   trace=trace)
+        seconds['reference'].append(reference_seconds)
+        if trace:
+            memory['reference'] = (peak, outside)
+        for name in timed:
+            engine_seconds, peak, outside = measure(
+                TIMED.get(name, ENGINES[name]), args, trace=trace)
+            seconds[name].append(engine_seconds)
+            speeds[name].append(reference_seconds / engine_seconds)
+            if trace:
+                memory[name] = (peak, outside)
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as bf:
+            baseline = json.load(bf)
+
+    failures = []
+    print('{:<16} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'engine', 'seconds', 'peak MB', 'outside MB', 'speed', 'baseline'))
+    print('{:<16} {:>10.3f} {:>10.1f} {:>10.1f} {:>10.2f} {:>10}'.format(
+        'reference', statistics.median(seconds['reference']),
+        memory['reference'][0], memory['reference'][1], 1, '-'))
+    for name in timed:
+        speed = statistics.median(speeds[name])
+        expected = baseline.get(name)
+        print('{:<16} {:>10.3f} {:>10.1f} {:>10.1f} {:>10.2f} {:>10}'.format(
+            name, statistics.median(seconds[name]), memory[name][0],
+            memory[name][1], speed,
+            '-' if expected is None else '{:.2f}'.format(expected)))
+        if update:
+            baseline[name] = round(speed, 3)
+        elif expected is not None and speed < expected * (1 - threshold):
+            failures.append('{} is {:.2f}x the reference, baseline {:.2f}x'
+                            .format(name, speed, expected))
+    if update:
+        with open(BASELINE, 'w') as bf:
+            json.dump(baseline, bf, indent=2, sort_keys=True)
+            bf.write('\n')
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that every engine flags the same purchases as '
+                    'the reference, and did not get slower.')
+    parser.add_argument('--cases', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINES),
+                        help='Only check this engine, may be repeated.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed loss of relative speed.')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='Rounds of timing, the median speed counts.')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--skip-performance', action='store_true')
+    options = parser.parse_args()
+    engines = options.engine or sorted(ENGINES)
+
+    if 'export' in engines and import_pyarrow() is None:
+        print('[SKIP]: the Parquet round-trip of export, pyarrow is missing')
+    failures = check_equivalence(options.cases, options.seed, engines)
+    if not options.skip_performance:
+        failures += check_performance(engines, options.threshold,
+                                      options.update_baseline,
+                                      options.rounds)
+    for failure in failures:
+        print('[FAIL]: {}'.format(failure))
+    if failures:
+        sys.exit(1)
+    print('[PASS]: {} cases, {} engines'.format(options.cases, len(engines)))
+
+if __name__ == '__main__':
+    main()
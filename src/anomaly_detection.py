@@ -1,5 +1,4 @@
 import json
-import os
 import sys
 
 def read_json(file):
@@ -177,8 +176,6 @@ def statistic_calculation(total_network, T, people_list):
         The standard deviation of at most T latest purchases.
     """
     total_purchase = []
-    total_amount = 0
-    mean_amount = 0
 
     # Collect all events of purchases within person's social network
     for p in [people_list[person_ID] for person_ID in total_network]:
@@ -188,6 +185,32 @@ def statistic_calculation(total_network, T, people_list):
     total_purchase.sort(key=lambda x: x.index, reverse=True)
     T_purchase = total_purchase[:T]
 
+    mean_amount, std_amount = mean_std(T_purchase)
+    return total_purchase, mean_amount, std_amount
+
+def mean_std(T_purchase):
+    """
+    Calculate the mean and standard deviation of amount of purchases.
+
+    Parameters
+    ----------
+    T_purchase: list
+        A list of Purchase, from the latest to the earliest.
+
+    Returns
+    -------
+    mean_amount: float
+        The mean of amount of purchases, 0 if there is no purchase.
+    std_amount: float
+        The standard deviation of amount of purchases, 0 if there is no
+        purchase.
+    """
+    total_amount = 0
+
+    # Friends without any purchase leave nothing to calculate.
+    if len(T_purchase) == 0:
+        return 0, 0
+
     # Calculate the total amount of money of purchases
     for purchase in T_purchase:
         total_amount += purchase.amount
@@ -195,7 +218,7 @@ def statistic_calculation(total_network, T, people_list):
     # Calculate the mean and standard deviation of purchases.
     mean_amount = total_amount/len(T_purchase)
     std_amount = std(T_purchase, mean_amount)
-    return total_purchase, mean_amount, std_amount
+    return mean_amount, std_amount
 
 def detect_anomaly(people_list, purchase_event, total_network, T):
     """
@@ -220,14 +243,39 @@ def detect_anomaly(people_list, purchase_event, total_network, T):
     anomaly: str
         A string for the flagged anomaly purchase.
     """
-    anomaly = {}
     total_purchase, mean_amount, std_amount = statistic_calculation(
         total_network, T, people_list)
+    return flag_purchase(purchase_event, len(total_purchase), mean_amount,
+                         std_amount)
+
+def flag_purchase(purchase_event, num_purchase, mean_amount, std_amount):
+    """
+    Flag a purchase that is 3 standard deviations higher than the mean of
+    purchases within network.
+
+    Parameters
+    ----------
+    purchase_event: dict
+        key: A string of 'event_type', 'timestamp', 'id', and 'amount'.
+        value: A string.
+    num_purchase: int
+        The total number of purchases within social network.
+    mean_amount: float
+        The mean of at most T latest purchases.
+    std_amount: float
+        The standard deviation of at most T latest purchases.
+
+    Returns
+    -------
+    anomaly: str
+        A string for the flagged anomaly purchase.
+    """
+    anomaly = {}
     pattern = '{{"event_type":"purchase", "timestamp":"{}", "id": "{}", "amount": "{}", "mean": "{:.2f}", "sd": "{:.2f}"}}'
 
     # Skip anomaly of purchases detection if the total number of purchases
     # within social network is less than 2.
-    if len(total_purchase) < 2:
+    if num_purchase < 2:
         return anomaly
     if float(purchase_event['amount']) > (mean_amount + 3 * std_amount):
         anomaly = pattern.format(purchase_event['timestamp'],
@@ -237,6 +285,73 @@ def detect_anomaly(people_list, purchase_event, total_network, T):
                                  std_amount)
     return anomaly
 
+def apply_event(people_list, event, index):
+    """
+    Update people_list with one event without checking for anomaly.
+
+    Parameters
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    event: dict
+        An event of 'purchase', 'befriend', or 'unfriend'.
+    index: int
+        The index of the event in the data. The lower the earlier.
+    """
+    if event['event_type'] == 'purchase':
+        if not event['id'] in people_list.keys():
+            people_list[event['id']] = Person(event['id'])
+        people_list[event['id']].add_purchase(event, index)
+    elif event['event_type'] == 'befriend':
+        if not event['id1'] in people_list.keys():
+            people_list[event['id1']] = Person(event['id1'])
+        people_list[event['id1']].add_friend(event)
+        if not event['id2'] in people_list.keys():
+            people_list[event['id2']] = Person(event['id2'])
+        people_list[event['id2']].add_friend(event)
+    else:  # for unfriend events
+        # In case of that there are missing events of befriend.
+        try:
+            people_list[event['id1']].delete_friend(event)
+            people_list[event['id2']].delete_friend(event)
+        except:
+            pass
+
+def process_event(people_list, event, index, D, T):
+    """
+    Check one streamed event for anomaly, then update people_list with it.
+
+    Parameters
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    event: dict
+        An event of 'purchase', 'befriend', or 'unfriend'.
+    index: int
+        The index of the event in the data. The lower the earlier.
+    D: int
+        The number of degree in social network.
+    T: int
+        The number of purchases that we want to track.
+
+    Returns
+    -------
+    anomaly: str
+        A string for the flagged anomaly purchase, empty if not flagged.
+    """
+    anomaly = {}
+    if event['event_type'] == 'purchase' and event['id'] in people_list.keys():
+        total_network = friend_network(people_list[event['id']], people_list, D)
+
+        # Skip the anomaly of purchase detection if the person has no
+        # friends.
+        if len(total_network) >= 1:
+            anomaly = detect_anomaly(people_list, event, total_network, T)
+    apply_event(people_list, event, index)
+    return anomaly
+
 def build_history(data):
     """
     Build the people_list, which include the information of Person's friends
@@ -259,24 +374,7 @@ def build_history(data):
     # Iterate through the data.
     for i in data:
         last_order = i
-        if data[i]['event_type'] == 'purchase':
-            if not data[i]['id'] in people_list.keys():
-                people_list[data[i]['id']] = Person(data[i]['id'])
-            people_list[data[i]['id']].add_purchase(data[i], i)
-        elif data[i]['event_type'] == 'befriend':
-            if not data[i]['id1'] in people_list.keys():
-                people_list[data[i]['id1']] = Person(data[i]['id1'])
-            people_list[data[i]['id1']].add_friend(data[i])
-            if not data[i]['id2'] in people_list.keys():
-                people_list[data[i]['id2']] = Person(data[i]['id2'])
-            people_list[data[i]['id2']].add_friend(data[i])
-        else:  # for unfriend events
-            # In case of that there are missing events of befriend.
-            try:
-                people_list[data[i]['id1']].delete_friend(data[i])
-                people_list[data[i]['id2']].delete_friend(data[i])
-            except:
-                pass
+        apply_event(people_list, data[i], i)
     return people_list, last_order
 
 def browse_data(people_list, data, D, T, initial_order):
@@ -310,35 +408,9 @@ def browse_data(people_list, data, D, T, initial_order):
     anomaly_list = []
 
     for i in data:
-        curr = i + initial_order
-        if data[i]['event_type'] == 'purchase':
-            if data[i]['id'] in people_list.keys():
-                total_network = friend_network(
-                    people_list[data[i]['id']], people_list, D)
-
-                # Skip the anomaly of purchase detection if the person has no
-                # friends.
-                if len(total_network) >= 1:
-                    anomaly = detect_anomaly(
-                        people_list, data[i], total_network, T)
-                    if anomaly:
-                        anomaly_list.append(anomaly)
-            else:
-                people_list[data[i]['id']] = Person(data[i]['id'])
-            people_list[data[i]['id']].add_purchase(data[i], curr)
-        elif data[i]['event_type'] == 'befriend':
-            if not data[i]['id1'] in people_list.keys():
-                people_list[data[i]['id1']] = Person(data[i]['id1'])
-            people_list[data[i]['id1']].add_friend(data[i])
-            if not data[i]['id2'] in people_list.keys():
-                people_list[data[i]['id2']] = Person(data[i]['id2'])
-            people_list[data[i]['id2']].add_friend(data[i])
-        else:
-            try:
-                people_list[data[i]['id1']].delete_friend(data[i])
-                people_list[data[i]['id2']].delete_friend(data[i])
-            except:
-                pass
+        anomaly = process_event(people_list, data[i], i + initial_order, D, T)
+        if anomaly:
+            anomaly_list.append(anomaly)
     return people_list, anomaly_list
 
 def net_friendship(person):
@@ -413,9 +485,25 @@ def friend_network(person, people_list, D):
         D -= 1
     return network
 
-def main():
-    input_batch_log = sys.argv[1]
-    input_stream_log = sys.argv[2]
+def run(input_batch_log, input_stream_log, output):
+    """
+    Detect anomaly of purchases in the stream log after the batch log, and
+    write the flagged purchases into the output file.
+
+    Parameters
+    ----------
+    input_batch_log: str
+        The path of the batch_log json file.
+    input_stream_log: str
+        The path of the stream_log json file.
+    output: str
+        The path of the flagged_purchases json file.
+
+    Returns
+    -------
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
     D, T, test_data = read_json(input_batch_log)
     _, _, test_update = read_json(input_stream_log)
     people_list, last_order = build_history(test_data)
@@ -427,8 +515,12 @@ def main():
         people_list, test_update, D, T, last_order + 1)
 
     str = '\n'.join(anomaly_list)
-    with open(sys.argv[3], 'w') as result:
+    with open(output, 'w') as result:
         result.write(str)
+    return anomaly_list
+
+def main():
+    run(sys.argv[1], sys.argv[2], sys.argv[3])
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,177 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import time
+
+from anomaly_detection import browse_data, build_history, read_json
+from journal import (JournalError, checkpoint_state, load_checkpoint,
+                     people_from_dict, recover, save_checkpoint)
+
+# The history every worker starts from. It is set before the workers are
+# forked, so they share its memory copy-on-write instead of receiving it.
+BASE = {}
+
+def load_base(batch_log=None, snapshot=None):
+    """
+    Build the history from a batch log, or load it from a snapshot.
+
+    A snapshot is a checkpoint of journal.py written by save_base, or the
+    journal directory of a journaled run. A directory is recovered like a
+    restart would, with the journal after its checkpoint, but the journal is
+    left as it is, since the run may still be writing it.
+
+    Returns
+    -------
+    base: dict
+        key: 'D', 'T', 'initial_order', and 'people_list'.
+    """
+    if snapshot is not None:
+        if os.path.isdir(snapshot):
+            state = recover_live(snapshot)
+        else:
+            state = load_checkpoint(snapshot)
+            if state is not None:
+                state['people_list'] = people_from_dict(state['people'])
+        if state is None:
+            raise IOError('No snapshot at {}'.format(snapshot))
+        # Stream events already in the snapshot come before the backtest.
+        return {'D': state['D'], 'T': state['T'],
+                'initial_order': state['initial_order'] + state['last'] + 1,
+                'people_list': state['people_list']}
+    D, T, test_data = read_json(batch_log)
+    people_list, last_order = build_history(test_data)
+    return {'D': D, 'T': T, 'initial_order': last_order + 1,
+            'people_list': people_list}
+
+def recover_live(journal_dir, attempts=20):
+    """
+    Recover a journal directory that a run may still be writing.
+
+    The run may write a new checkpoint and start a new journal between the
+    reads of recover, which then finds a journal that does not follow the
+    checkpoint it read. Reading again gets a matching pair.
+    """
+    for attempt in range(attempts):
+        try:
+            return recover(journal_dir, repair=False)
+        except JournalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.05)
+
+def save_base(base, snapshot):
+    """
+    Write the history to a snapshot that load_base reads back.
+    """
+    save_checkpoint(snapshot, checkpoint_state(
+        base['D'], base['T'], base['initial_order'], -1,
+        base['people_list'], []))
+
+def replay(position, stream_log, output_dir=None):
+    """
+    Replay one stream file from BASE. Runs in a forked worker, which changes
+    its own copy of the history only. position numbers the flags file, since
+    archived stream files often share a name.
+
+    Returns
+    -------
+    result: dict
+        key: 'file', 'events', 'flags', and 'seconds'.
+    """
+    start = time.perf_counter()
+    _, _, test_update = read_json(stream_log)
+    _, anomaly_list = browse_data(BASE['people_list'], test_update,
+                                  BASE['D'], BASE['T'], BASE['initial_order'])
+    if output_dir is not None:
+        name = os.path.splitext(os.path.basename(stream_log))[0]
+        with open(os.path.join(output_dir, '{:04d}_{}.flagged.json'.format(
+                position, name)), 'w') as result:
+            result.write('\n'.join(anomaly_list))
+    return {'file': stream_log, 'events': len(test_update),
+            'flags': len(anomaly_list),
+            'seconds': time.perf_counter() - start}
+
+def backtest(base, stream_logs, workers=None, output_dir=None):
+    """
+    Replay every stream file from the same history, in parallel.
+
+    Every file gets a freshly forked worker, so no file sees the events of
+    another one.
+
+    Parameters
+    ----------
+    base: dict
+        The history, as returned by load_base.
+    stream_logs: list
+        The paths of the stream_log json files.
+    workers: int
+        The number of worker processes, all cores by default.
+    output_dir: str
+        The directory to write the flags of every file into, if any.
+
+    Returns
+    -------
+    report: dict
+        key: 'files', a list of the results of replay in the order of
+        stream_logs, and 'flags', 'workers', and 'seconds' for all files.
+    """
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    workers = workers or os.cpu_count() or 1
+    BASE.clear()
+    BASE.update(base)
+
+    # Keep the collector from touching the history in the workers, which
+    # would copy its pages.
+    gc.freeze()
+    start = time.perf_counter()
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, maxtasksperchild=1) as pool:
+            files = pool.starmap(replay, [
+                (position, stream_log, output_dir)
+                for position, stream_log in enumerate(stream_logs)],
+                chunksize=1)
+    finally:
+        gc.unfreeze()
+    return {'files': files, 'flags': sum(f['flags'] for f in files),
+            'workers': workers, 'seconds': time.perf_counter() - start}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay many stream logs from the same history.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--batch', help='batch_log json file')
+    source.add_argument('--snapshot',
+                        help='snapshot of a history, or a journal directory')
+    parser.add_argument('--save-snapshot',
+                        help='write the history to this snapshot')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--output-dir',
+                        help='write the flags of every stream log here')
+    parser.add_argument('--report', help='write the report json here')
+    parser.add_argument('stream_logs', nargs='*')
+    options = parser.parse_args()
+
+    base = load_base(options.batch, options.snapshot)
+    if options.save_snapshot:
+        save_base(base, options.save_snapshot)
+    if not options.stream_logs:
+        return
+
+    report = backtest(base, options.stream_logs, options.workers,
+                      options.output_dir)
+    if options.report:
+        with open(options.report, 'w') as rf:
+            json.dump(report, rf, indent=2)
+    for result in report['files']:
+        print('{file}: {events} events, {flags} flags, {seconds:.3f} s'
+              .format(**result))
+    print('{} files, {} flags, {} workers, {:.3f} s'.format(
+        len(report['files']), report['flags'], report['workers'],
+        report['seconds']))
+
+if __name__ == '__main__':
+    main()
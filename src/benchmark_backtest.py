@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from anomaly_detection import run
+from backtest import backtest, load_base
+from synthetic import generate_events, write_log
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    num_batch = int(sys.argv[2]) if len(sys.argv) > 2 else 40000
+    num_stream = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        batch_log = os.path.join(work_dir, 'batch_log.json')
+        write_log(batch_log, generate_events(num_batch, 4000), 2, 50)
+        stream_logs = []
+        for seed in range(num_files):
+            stream_log = os.path.join(work_dir, 'stream_{}.json'.format(seed))
+            write_log(stream_log, generate_events(num_stream, 4000, seed + 1))
+            stream_logs.append(stream_log)
+
+        # Today: every stream file rebuilds the history.
+        start = time.perf_counter()
+        expected = [len(run(batch_log, stream_log,
+                            os.path.join(work_dir, 'flagged.json')))
+                    for stream_log in stream_logs]
+        rebuild = time.perf_counter() - start
+
+        start = time.perf_counter()
+        base = load_base(batch_log)
+        build = time.perf_counter() - start
+        print('{:>8} {:>10} {:>10}'.format('workers', 'seconds', 'speedup'))
+        print('{:>8} {:>10.2f} {:>10}'.format('rebuild', rebuild, '1.00'))
+        for workers in sorted(set([1, 2, 4, os.cpu_count() or 1])):
+            report = backtest(base, stream_logs, workers)
+            flags = [result['flags'] for result in report['files']]
+            assert flags == expected, 'Backtest flags differ'
+            seconds = build + report['seconds']
+            print('{:>8} {:>10.2f} {:>10.2f}'.format(
+                workers, seconds, rebuild / seconds))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import sys
+import time
+
+from anomaly_detection import build_history, process_event
+from benchmark_journal import split_events
+from hubs import HubAwareEngine
+from synthetic import generate_power_law_events
+
+def percentile(latency, share):
+    """
+    The latency below which a share of events fall.
+    """
+    return latency[min(len(latency) - 1, int(share * len(latency)))]
+
+def time_events(process, stream, initial_order):
+    """
+    Time every streamed event.
+
+    Returns
+    -------
+    latency: list
+        The sorted time of every event, in milliseconds.
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
+    latency = []
+    anomaly_list = []
+    for i in stream:
+        start = time.perf_counter()
+        anomaly = process(stream[i], i + initial_order)
+        latency.append(1000 * (time.perf_counter() - start))
+        if anomaly:
+            anomaly_list.append(anomaly)
+    latency.sort()
+    return latency, anomaly_list
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 60000
+    num_people = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    hub_degree = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    T = 50
+    batch, stream = split_events(
+        generate_power_law_events(num_events, num_people), num_events // 2)
+
+    print('{:>3} {:<16} {:>10} {:>10} {:>10} {:>8}'.format(
+        'D', 'engine', 'p50 ms', 'p99 ms', 'max ms', 'capped'))
+    for D in [1, 2, 3]:
+        people_list, last_order = build_history(batch)
+        latency, expected = time_events(
+            lambda event, index: process_event(
+                people_list, event, index, D, T),
+            stream, last_order + 1)
+        print('{:>3} {:<16} {:>10.3f} {:>10.3f} {:>10.3f} {:>8}'.format(
+            D, 'people_list', percentile(latency, 0.5),
+            percentile(latency, 0.99), latency[-1], '-'))
+
+        for name, expansion_cap in [('hubs', None), ('hubs, cap 100', 100)]:
+            engine = HubAwareEngine(D, T, hub_degree, expansion_cap)
+            last_order = engine.build_history(batch)
+            latency, anomaly_list = time_events(
+                engine.process_event, stream, last_order + 1)
+            if expansion_cap is None:
+                assert anomaly_list == expected, 'Hub flags differ'
+            print('{:>3} {:<16} {:>10.3f} {:>10.3f} {:>10.3f} {:>8}'.format(
+                D, name, percentile(latency, 0.5),
+                percentile(latency, 0.99), latency[-1],
+                engine.report()['capped_events']))
+
+if __name__ == '__main__':
+    main()
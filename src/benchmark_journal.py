@@ -0,0 +1,80 @@
+import shutil
+import sys
+import tempfile
+import time
+
+from anomaly_detection import browse_data, build_history
+from journal import journaled_browse
+from synthetic import generate_events
+
+def split_events(events, num_batch):
+    """
+    Split generated events into a batch and a stream, as read_json would.
+
+    Parameters
+    ----------
+    events: dict
+        key: An integer for the index of events.
+        value: An event.
+    num_batch: int
+        The number of events in the batch.
+
+    Returns
+    -------
+    batch: dict
+        The first num_batch events.
+    stream: dict
+        The rest of events, indexed from 0.
+    """
+    batch = dict((i, events[i]) for i in range(num_batch))
+    stream = dict((i - num_batch, events[i])
+                  for i in range(num_batch, len(events)))
+    return batch, stream
+
+def time_browse(batch, stream, D, T, journal_dir=None, commit_interval=64):
+    """
+    Time streaming with or without the journal.
+
+    Returns
+    -------
+    seconds: float
+        The time spent on streaming.
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
+    people_list, last_order = build_history(batch)
+    start = time.perf_counter()
+    if journal_dir is None:
+        _, anomaly_list = browse_data(
+            people_list, stream, D, T, last_order + 1)
+    else:
+        _, anomaly_list = journaled_browse(
+            people_list, stream, D, T, last_order + 1, journal_dir,
+            commit_interval)
+    return time.perf_counter() - start, anomaly_list
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_people = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    D, T = 2, 50
+    batch, stream = split_events(
+        generate_events(num_events, num_people), num_events // 2)
+
+    seconds, expected = time_browse(batch, stream, D, T)
+    print('{:>10} {:>12} {:>10}'.format('interval', 'events/s', 'cost'))
+    print('{:>10} {:>12.0f} {:>10}'.format(
+        'none', len(stream) / seconds, '-'))
+    for commit_interval in [1, 16, 256, 4096]:
+        journal_dir = tempfile.mkdtemp()
+        try:
+            journal_seconds, anomaly_list = time_browse(
+                batch, stream, D, T, journal_dir, commit_interval)
+        finally:
+            shutil.rmtree(journal_dir)
+        assert anomaly_list == expected, 'Journaled flags differ'
+        print('{:>10} {:>12.0f} {:>9.1f}%'.format(
+            commit_interval, len(stream) / journal_seconds,
+            100 * (journal_seconds / seconds - 1)))
+
+if __name__ == '__main__':
+    main()
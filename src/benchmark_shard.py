@@ -0,0 +1,59 @@
+import sys
+import time
+
+from anomaly_detection import browse_data, build_history
+from benchmark_journal import split_events
+from shard import ShardedGraph, community_partition
+from synthetic import generate_events
+
+def time_sharded(batch, stream, D, T, num_shards, partition):
+    """
+    Time streaming on a sharded graph.
+
+    Returns
+    -------
+    seconds: float
+        The time spent on streaming.
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
+    graph = ShardedGraph(num_shards, partition)
+    try:
+        last_order = graph.build_history(batch)
+        # Wait until every shard applied the batch.
+        graph.sizes()
+        start = time.perf_counter()
+        anomaly_list = graph.browse_data(stream, D, T, last_order + 1)
+        graph.sizes()
+        return time.perf_counter() - start, anomaly_list
+    finally:
+        graph.close()
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    D, T = 2, 50
+
+    print('{:>8} {:>7} {:>10} {:>12}'.format(
+        'people', 'shards', 'partition', 'events/s'))
+    for num_people in [500, 2000, 8000]:
+        batch, stream = split_events(
+            generate_events(num_events, num_people), num_events // 2)
+        people_list, last_order = build_history(batch)
+        start = time.perf_counter()
+        _, expected = browse_data(people_list, stream, D, T, last_order + 1)
+        print('{:>8} {:>7} {:>10} {:>12.0f}'.format(
+            num_people, '-', 'single', len(stream) /
+            (time.perf_counter() - start)))
+        for num_shards in [1, 2, 4, 8]:
+            for method in ['hash', 'community']:
+                partition = None
+                if method == 'community':
+                    partition = community_partition(batch, num_shards)
+                seconds, anomaly_list = time_sharded(
+                    batch, stream, D, T, num_shards, partition)
+                assert anomaly_list == expected, 'Sharded flags differ'
+                print('{:>8} {:>7} {:>10} {:>12.0f}'.format(
+                    num_people, num_shards, method, len(stream) / seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import multiprocessing
+import random
+import sys
+import time
+
+from benchmark_journal import split_events
+from shared_store import SharedGraphReader, SharedGraphWriter, required_size
+from synthetic import generate_events
+
+def reader(name, purchases, D, done, results):
+    """
+    Score random purchases against the live graph until the writer is done.
+    """
+    graph = SharedGraphReader(name)
+    rng = random.Random()
+    queries = 0
+    while not done.is_set():
+        graph.detect(rng.choice(purchases), D)
+        queries += 1
+    results.put((queries, graph.retries, graph.pauses))
+    graph.close()
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    num_people = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    D, T = 2, 50
+    batch, stream = split_events(
+        generate_events(num_events, num_people), num_events // 2)
+    purchases = [event for event in stream.values()
+                 if event['event_type'] == 'purchase']
+    capacity, edge_capacity, id_bytes = required_size(batch, stream)
+
+    print('{:>8} {:>12} {:>12} {:>10} {:>8}'.format(
+        'readers', 'writes/s', 'queries/s', 'retries', 'pauses'))
+    for num_readers in [0, 1, 2, 4]:
+        graph = SharedGraphWriter(capacity, edge_capacity, T, id_bytes)
+        try:
+            last_order = graph.build_history(batch)
+            done = multiprocessing.Event()
+            results = multiprocessing.Queue()
+            readers = [multiprocessing.Process(
+                target=reader, args=(graph.name, purchases, D, done, results))
+                for _ in range(num_readers)]
+            for process in readers:
+                process.start()
+
+            start = time.perf_counter()
+            for i in stream:
+                graph.apply_event(stream[i], i + last_order + 1)
+            seconds = time.perf_counter() - start
+            done.set()
+
+            queries, retries, pauses = 0, 0, 0
+            for _ in readers:
+                reader_queries, reader_retries, reader_pauses = results.get()
+                queries += reader_queries
+                retries += reader_retries
+                pauses += reader_pauses
+            for process in readers:
+                process.join()
+        finally:
+            graph.unlink()
+        print('{:>8} {:>12.0f} {:>12.0f} {:>9.1f}% {:>8}'.format(
+            num_readers, len(stream) / seconds, queries / seconds,
+            100 * retries / max(1, queries + retries), pauses))
+
+if __name__ == '__main__':
+    main()
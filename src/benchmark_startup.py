@@ -0,0 +1,80 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic import generate_events, write_log
+from worker import submit
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+def wait_for(socket_path, timeout=10):
+    """
+    Wait until a worker listens on socket_path.
+    """
+    deadline = time.time() + timeout
+    while not os.path.exists(socket_path):
+        if time.time() > deadline:
+            raise RuntimeError('Worker did not start')
+        time.sleep(0.01)
+
+def average_ms(function, repeat):
+    """
+    Run function repeat times and return the average time in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return 1000 * (time.perf_counter() - start) / repeat
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    num_events = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        # A small per-merchant log.
+        events = generate_events(num_events, num_events // 10 + 2)
+        batch = os.path.join(work_dir, 'batch_log.json')
+        stream = os.path.join(work_dir, 'stream_log.json')
+        output = os.path.join(work_dir, 'flagged_purchases.json')
+        half = num_events // 2
+        write_log(batch, dict((i, events[i]) for i in range(half)), 2, 50)
+        write_log(stream, dict((i, events[half + i])
+                               for i in range(num_events - half)))
+        args = [batch, stream, output]
+
+        cold = average_ms(lambda: subprocess.check_call(
+            [sys.executable, os.path.join(SRC, 'anomaly_detection.py')]
+            + args), repeat)
+
+        socket_path = os.path.join(work_dir, 'worker.sock')
+        worker = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'worker.py'), 'serve',
+             socket_path])
+        try:
+            wait_for(socket_path)
+            warm = average_ms(lambda: submit(
+                socket_path, {'backend': 'plain', 'args': args}), repeat)
+            warm_cli = average_ms(lambda: subprocess.check_call(
+                [sys.executable, os.path.join(SRC, 'worker.py'), 'submit',
+                 socket_path, 'plain'] + args,
+                stdout=subprocess.DEVNULL), repeat)
+            submit(socket_path, {'command': 'stop'})
+        finally:
+            # Stop the worker even if it never got the stop request, without
+            # hiding the error that brought us here.
+            worker.terminate()
+            worker.wait()
+
+        print('{:<28} {:>10}'.format('entry point', 'ms/call'))
+        print('{:<28} {:>10.2f}'.format('cold main()', cold))
+        print('{:<28} {:>10.2f}'.format('warm worker, socket', warm))
+        print('{:<28} {:>10.2f}'.format('warm worker, cli client', warm_cli))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from synthetic import generate_events, write_log
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+def make_tenant(tenant_dir, seed, num_events, num_people):
+    """
+    Lay out a tenant directory like this repository, with synthetic logs.
+    """
+    os.makedirs(os.path.join(tenant_dir, 'log_input'))
+    os.makedirs(os.path.join(tenant_dir, 'log_output'))
+    events = generate_events(num_events, num_people, seed)
+    half = num_events // 2
+    write_log(os.path.join(tenant_dir, 'log_input', 'batch_log.json'),
+              dict((i, events[i]) for i in range(half)), 2, 50)
+    write_log(os.path.join(tenant_dir, 'log_input', 'stream_log.json'),
+              dict((i, events[half + i]) for i in range(num_events - half)))
+
+def wait_all(processes):
+    """
+    Wait for processes and add up their peak memory and cpu time.
+
+    Returns
+    -------
+    memory: float
+        The sum of peak resident memory, in megabytes.
+    cpu: float
+        The sum of user and system cpu time, in seconds.
+    """
+    memory, cpu = 0, 0
+    for process in processes:
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise RuntimeError('A detection process failed')
+        memory += usage.ru_maxrss / 1024
+        cpu += usage.ru_utime + usage.ru_stime
+    return memory, cpu
+
+def read_outputs(tenant_dirs):
+    outputs = []
+    for tenant_dir in tenant_dirs:
+        with open(os.path.join(tenant_dir, 'log_output',
+                               'flagged_purchases.json')) as result:
+            outputs.append(result.read())
+    return outputs
+
+def main():
+    num_tenants = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    num_events = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    num_people = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        tenant_dirs = []
+        for seed in range(num_tenants):
+            tenant_dir = os.path.join(work_dir, 'merchant_{}'.format(seed))
+            make_tenant(tenant_dir, seed, num_events, num_people)
+            tenant_dirs.append(tenant_dir)
+
+        # One process per merchant, all running at once.
+        separate = wait_all([subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'anomaly_detection.py'),
+             os.path.join(tenant_dir, 'log_input', 'batch_log.json'),
+             os.path.join(tenant_dir, 'log_input', 'stream_log.json'),
+             os.path.join(tenant_dir, 'log_output', 'flagged_purchases.json')])
+            for tenant_dir in tenant_dirs])
+        expected = read_outputs(tenant_dirs)
+        # So a merchant the engine skipped has no output to compare.
+        for tenant_dir in tenant_dirs:
+            os.remove(os.path.join(tenant_dir, 'log_output',
+                                   'flagged_purchases.json'))
+
+        partitioned = wait_all([subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'tenant.py'),
+             os.path.join(work_dir, 'snapshots')] + tenant_dirs)])
+        assert read_outputs(tenant_dirs) == expected, 'Tenant flags differ'
+
+        print('{:<24} {:>12} {:>10}'.format('mode', 'memory MB', 'cpu s'))
+        print('{:<24} {:>12.1f} {:>10.2f}'.format(
+            '{} processes'.format(num_tenants), *separate))
+        print('{:<24} {:>12.1f} {:>10.2f}'.format(
+            'partitioned engine', *partitioned))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
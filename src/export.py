@@ -0,0 +1,343 @@
+import collections
+import heapq
+import itertools
+import json
+import operator
+import os
+import sys
+from array import array
+
+from anomaly_detection import browse_data, build_history, read_json
+
+# Every table is a set of columns of the same length. Numeric columns have an
+# array typecode, 'str' columns hold strings. Both edges and purchases are
+# sorted by person, and the end columns of people index into them: the
+# friends of person p are edges[friend_end[p - 1]:friend_end[p]]. spent is
+# the total amount of each person's purchases.
+SCHEMA = {
+    'people': {'id': 'str', 'friend_end': 'q', 'purchase_end': 'q',
+               'spent': 'd'},
+    'edges': {'friend': 'q'},
+    'purchases': {'index': 'q', 'amount': 'd', 'timestamp': 'str'},
+}
+MANIFEST_FILE = 'manifest.json'
+
+def people_to_columns(people_list):
+    """
+    Convert people_list into columns, with people numbered by code.
+
+    Parameters
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+
+    Returns
+    -------
+    tables: dict
+        key: The name of a table in SCHEMA.
+        value: A dictionary of columns, array or list of strings.
+    """
+    ids = sorted(people_list)
+    code = dict((person_ID, i) for i, person_ID in enumerate(ids))
+    friend_end = array('q')
+    purchase_end = array('q')
+    spent = array('d')
+    friend = array('q')
+    index = array('q')
+    amount = array('d')
+    timestamp = []
+    for person_ID in ids:
+        person = people_list[person_ID]
+        friend.extend(sorted(code[friend_ID] for friend_ID in person.friend))
+        friend_end.append(len(friend))
+        for purchase in person.purchase:
+            index.append(purchase.index)
+            amount.append(purchase.amount)
+            timestamp.append(purchase.timestamp)
+        spent.append(sum(amount[len(amount) - len(person.purchase):]))
+        purchase_end.append(len(index))
+    return {'people': {'id': ids, 'friend_end': friend_end,
+                       'purchase_end': purchase_end, 'spent': spent},
+            'edges': {'friend': friend},
+            'purchases': {'index': index, 'amount': amount,
+                          'timestamp': timestamp}}
+
+def import_pyarrow():
+    """
+    Import pyarrow only when Parquet is used, and only if it is installed.
+
+    Returns
+    -------
+    modules: tuple
+        pyarrow and pyarrow.parquet, or None if pyarrow is missing.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+def export(people_list, out_dir, format='auto'):
+    """
+    Write people_list into columnar files.
+
+    Parameters
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    out_dir: str
+        The directory of the files.
+    format: str
+        'parquet', 'array' for raw typed arrays, or 'auto' for Parquet when
+        pyarrow is installed and typed arrays otherwise.
+
+    Returns
+    -------
+    format: str
+        The format that was written.
+    """
+    if format == 'auto':
+        format = 'parquet' if import_pyarrow() else 'array'
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    tables = people_to_columns(people_list)
+    if format == 'parquet':
+        write_parquet(tables, out_dir)
+    elif format == 'array':
+        write_arrays(tables, out_dir)
+    else:
+        raise ValueError('Unknown format: {}'.format(format))
+
+    # Write the manifest last, so a directory without one is incomplete.
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as mf:
+        json.dump({'format': format, 'byteorder': sys.byteorder}, mf)
+    return format
+
+def write_arrays(tables, out_dir):
+    """
+    Write every numeric column as raw machine values, and every string
+    column as a json list.
+    """
+    for table, columns in tables.items():
+        for name, column in columns.items():
+            path = os.path.join(out_dir, '{}.{}'.format(table, name))
+            if SCHEMA[table][name] == 'str':
+                with open(path + '.json', 'w') as cf:
+                    json.dump(column, cf)
+            else:
+                with open(path + '.bin', 'wb') as cf:
+                    column.tofile(cf)
+
+def write_parquet(tables, out_dir):
+    """
+    Write every table as one Parquet file.
+    """
+    pyarrow, parquet = import_pyarrow()
+    types = {'q': pyarrow.int64(), 'd': pyarrow.float64()}
+    for table, columns in tables.items():
+        arrays = []
+        for name, column in columns.items():
+            typecode = SCHEMA[table][name]
+            if typecode == 'str':
+                arrays.append(pyarrow.array(column, type=pyarrow.string()))
+            else:
+                arrays.append(pyarrow.Array.from_buffers(
+                    types[typecode], len(column),
+                    [None, pyarrow.py_buffer(column)]))
+        parquet.write_table(
+            pyarrow.Table.from_arrays(arrays, names=list(columns)),
+            os.path.join(out_dir, '{}.parquet'.format(table)))
+
+def read_arrays(out_dir, manifest):
+    tables = {}
+    for table, schema in SCHEMA.items():
+        tables[table] = {}
+        for name, typecode in schema.items():
+            path = os.path.join(out_dir, '{}.{}'.format(table, name))
+            if typecode == 'str':
+                with open(path + '.json') as cf:
+                    tables[table][name] = json.load(cf)
+                continue
+            column = array(typecode)
+            with open(path + '.bin', 'rb') as cf:
+                column.fromfile(
+                    cf, os.path.getsize(path + '.bin') // column.itemsize)
+            if manifest['byteorder'] != sys.byteorder:
+                column.byteswap()
+            tables[table][name] = column
+    return tables
+
+def read_parquet(out_dir):
+    pyarrow, parquet = import_pyarrow()
+    tables = {}
+    for table, schema in SCHEMA.items():
+        data = parquet.read_table(
+            os.path.join(out_dir, '{}.parquet'.format(table)))
+        tables[table] = {}
+        for name, typecode in schema.items():
+            chunk = data.column(name).combine_chunks()
+            if typecode == 'str':
+                tables[table][name] = chunk.to_pylist()
+                continue
+            # Copy the values buffer straight into an array, without making a
+            # python object per value.
+            column = array(typecode)
+            start = chunk.offset * column.itemsize
+            column.frombytes(memoryview(chunk.buffers()[1])[
+                start:start + len(chunk) * column.itemsize])
+            tables[table][name] = column
+    return tables
+
+class ColumnarStore(object):
+    """
+    A Class, ColumnarStore.
+    Queries on an exported people_list, answered by scans over columns.
+
+    Attributes
+    ----------
+    ids: list
+        The ids of people, by code.
+    code: dict
+        key: A string for Person's ID
+        value: The code of the person.
+    friend_offset: array
+        Where the friends of every person start in friend.
+    friend: array
+        The codes of friends, sorted by person.
+    purchase_offset: array
+        Where the purchases of every person start in the purchase columns.
+    amount: array
+        The amount of every purchase.
+    index: array
+        The index of every purchase in the data.
+    spent: array
+        The total amount of the purchases of every person.
+    """
+    def __init__(self, out_dir):
+        with open(os.path.join(out_dir, MANIFEST_FILE)) as mf:
+            manifest = json.load(mf)
+        if manifest['format'] == 'parquet':
+            if import_pyarrow() is None:
+                raise ImportError('Reading Parquet exports needs pyarrow')
+            tables = read_parquet(out_dir)
+        else:
+            tables = read_arrays(out_dir, manifest)
+        self.ids = tables['people']['id']
+        self.code = dict((person_ID, i) for i, person_ID in enumerate(self.ids))
+        self.friend_offset = array('q', [0]) + tables['people']['friend_end']
+        self.purchase_offset = (array('q', [0])
+                                + tables['people']['purchase_end'])
+        self.friend = tables['edges']['friend']
+        self.amount = tables['purchases']['amount']
+        self.index = tables['purchases']['index']
+        self.timestamp = tables['purchases']['timestamp']
+        self.spent = tables['people']['spent']
+
+    def friends(self, code):
+        return self.friend[self.friend_offset[code]:
+                           self.friend_offset[code + 1]]
+
+    def degree(self, person_ID):
+        """
+        The number of direct friends of a person, 0 for an unknown person.
+        """
+        code = self.code.get(person_ID)
+        if code is None:
+            return 0
+        return self.friend_offset[code + 1] - self.friend_offset[code]
+
+    def degree_counts(self):
+        """
+        How many people have each number of friends.
+
+        Returns
+        -------
+        counts: dict
+            key: A number of friends.
+            value: The number of people with that many friends.
+        """
+        return dict(collections.Counter(map(
+            operator.sub, self.friend_offset[1:], self.friend_offset[:-1])))
+
+    def purchase_stats(self, person_ID):
+        """
+        Summarize the purchases of a person.
+
+        Returns
+        -------
+        stats: dict
+            key: 'count', 'total', 'mean', 'min', and 'max', all 0 for an
+            unknown person.
+        """
+        code = self.code.get(person_ID)
+        if code is None:
+            amount = []
+        else:
+            amount = self.amount[self.purchase_offset[code]:
+                                 self.purchase_offset[code + 1]]
+        if len(amount) == 0:
+            return {'count': 0, 'total': 0, 'mean': 0, 'min': 0, 'max': 0}
+        total = self.spent[code]
+        return {'count': len(amount), 'total': total,
+                'mean': total / len(amount), 'min': min(amount),
+                'max': max(amount)}
+
+    def network(self, person_ID, D):
+        """
+        The codes of the same network that friend_network finds, empty for an
+        unknown person.
+        """
+        if person_ID not in self.code:
+            return set()
+        network = set(self.friends(self.code[person_ID]))
+        while D > 1:
+            network = set(itertools.chain.from_iterable(
+                map(self.friends, network)))
+            D -= 1
+        return network
+
+    def top_spenders(self, person_ID, D, k=10):
+        """
+        The people who spent most within D degree of social network of a
+        person.
+
+        Returns
+        -------
+        spenders: list
+            A list of (Person's ID, total amount), the largest first, and
+            the lowest code first among equal amounts.
+        """
+        network = sorted(self.network(person_ID, D))
+        return [(self.ids[code], self.spent[code])
+                for code in heapq.nlargest(k, network,
+                                           key=self.spent.__getitem__)]
+
+def main():
+    command = sys.argv[1]
+    if command == 'export':
+        # export BATCH STREAM OUT_DIR [FORMAT]
+        D, T, test_data = read_json(sys.argv[2])
+        _, _, test_update = read_json(sys.argv[3])
+        people_list, last_order = build_history(test_data)
+        browse_data(people_list, test_update, D, T, last_order + 1)
+        format = sys.argv[5] if len(sys.argv) > 5 else 'auto'
+        print(export(people_list, sys.argv[4], format))
+        return
+
+    store = ColumnarStore(sys.argv[2])
+    if command == 'degree':
+        result = store.degree(sys.argv[3])
+    elif command == 'degree_counts':
+        result = store.degree_counts()
+    elif command == 'purchases':
+        result = store.purchase_stats(sys.argv[3])
+    else:  # for top PERSON D [K]
+        k = int(sys.argv[5]) if len(sys.argv) > 5 else 10
+        result = store.top_spenders(sys.argv[3], int(sys.argv[4]), k)
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
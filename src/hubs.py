@@ -0,0 +1,273 @@
+import heapq
+import sys
+
+from anomaly_detection import (apply_event, build_history, flag_purchase,
+                               mean_std, read_json)
+
+class HubAwareEngine(object):
+    """
+    A Class, HubAwareEngine.
+    Same detection as browse_data, with people of many friends kept apart.
+
+    A person with at least hub_degree friends is a hub. Each hub keeps the
+    latest T purchases of its friends, updated when a friend buys or a new
+    friend joins. The last degree of friend_network then reads those T
+    purchases instead of scanning every friend of a hub. Only the latest T
+    purchases of a network count, and at least 2 of them are found whenever
+    the network has 2 purchases, so flags do not change.
+
+    Attributes
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    D: int
+        The number of degree in social network.
+    T: int
+        The number of purchases that we want to track.
+    hub_degree: int
+        The number of friends that makes a person a hub.
+    expansion_cap: int
+        The largest number of people kept in a frontier before the last
+        degree. None to never cap. A capped network may miss people, so every
+        capped event is recorded in capped.
+    hub_purchase: dict
+        key: A string for a hub's ID
+        value: The list of the latest T purchases of the hub's friends, from
+        the earliest to the latest.
+    hub_friend: dict
+        key: A string for Person's ID
+        value: The set of ids of hubs among the person's friends.
+    capped: list
+        A list of (index of the event, size of the frontier) for every
+        purchase whose network was capped.
+    """
+    def __init__(self, D, T, hub_degree=64, expansion_cap=None):
+        assert D >=1, 'Please enter value >= 1 for D'
+        assert T >= 2, 'Please enter value >= 2 for T'
+        self.people_list = {}
+        self.D = D
+        self.T = T
+        self.hub_degree = hub_degree
+        self.expansion_cap = expansion_cap
+        self.hub_purchase = {}
+        self.hub_friend = {}
+        self.capped = []
+
+    def promote(self, hub_ID):
+        """
+        Make a person a hub, and collect the latest T purchases of friends.
+        """
+        candidate = []
+        for person_ID in self.people_list[hub_ID].friend:
+            candidate.extend(self.people_list[person_ID].purchase[-self.T:])
+            self.hub_friend.setdefault(person_ID, set()).add(hub_ID)
+        candidate.sort(key=lambda x: x.index)
+        self.hub_purchase[hub_ID] = candidate[-self.T:]
+
+    def demote(self, hub_ID):
+        del self.hub_purchase[hub_ID]
+        for hubs in self.hub_friend.values():
+            hubs.discard(hub_ID)
+
+    def refresh(self, person_ID):
+        """
+        Promote, demote or rebuild a person after their friends changed.
+        """
+        if person_ID in self.hub_purchase:
+            self.demote(person_ID)
+        if self.degree(person_ID) >= self.hub_degree:
+            self.promote(person_ID)
+
+    def add_friend(self, hub_ID, person_ID):
+        """
+        Merge the latest T purchases of a new friend into a hub's purchases.
+        """
+        self.hub_friend.setdefault(person_ID, set()).add(hub_ID)
+        merged = list(heapq.merge(
+            self.hub_purchase[hub_ID],
+            self.people_list[person_ID].purchase[-self.T:],
+            key=lambda x: x.index))
+        self.hub_purchase[hub_ID] = merged[-self.T:]
+
+    def apply_event(self, event, index):
+        """
+        Same as anomaly_detection.apply_event, keeping the hubs up to date.
+        """
+        if event['event_type'] == 'purchase':
+            apply_event(self.people_list, event, index)
+            purchase = self.people_list[event['id']].purchase[-1]
+            # The new purchase is the latest of every hub it reaches.
+            for hub_ID in self.hub_friend.get(event['id'], ()):
+                hub_purchase = self.hub_purchase[hub_ID]
+                hub_purchase.append(purchase)
+                if len(hub_purchase) > self.T:
+                    del hub_purchase[0]
+            return
+
+        id1, id2 = event['id1'], event['id2']
+        pairs = [(id1, id2)]
+        if id1 != id2:
+            pairs.append((id2, id1))
+        before = dict((person_ID, self.friend_of(person_ID, friend_ID))
+                      for person_ID, friend_ID in pairs)
+        size = dict((person_ID, self.degree(person_ID))
+                    for person_ID, _ in pairs)
+        apply_event(self.people_list, event, index)
+        for person_ID, friend_ID in pairs:
+            if event['event_type'] == 'befriend':
+                if before[person_ID]:
+                    continue
+                if person_ID in self.hub_purchase:
+                    self.add_friend(person_ID, friend_ID)
+                elif self.degree(person_ID) >= self.hub_degree:
+                    self.promote(person_ID)
+            elif self.degree(person_ID) != size[person_ID]:
+                self.refresh(person_ID)
+
+    def friend_of(self, person_ID, friend_ID):
+        return (person_ID in self.people_list
+                and friend_ID in self.people_list[person_ID].friend)
+
+    def degree(self, person_ID):
+        if person_ID not in self.people_list:
+            return 0
+        return len(self.people_list[person_ID].friend)
+
+    def build_history(self, data):
+        """
+        Same as anomaly_detection.build_history, then find the hubs.
+
+        Returns
+        -------
+        last_order: int
+            The index of the last event.
+        """
+        self.people_list, last_order = build_history(data)
+        for person_ID, person in self.people_list.items():
+            if len(person.friend) >= self.hub_degree:
+                self.promote(person_ID)
+        return last_order
+
+    def frontier(self, person_ID, index):
+        """
+        The people whose friends make up the network of a person, that is
+        the network of degree D - 1, or the person for D = 1.
+        """
+        network = set([person_ID])
+        D = self.D
+        while D > 1:
+            whole_network = set()
+            for friend_ID in network:
+                whole_network.update(self.people_list[friend_ID].friend)
+            network = whole_network
+            D -= 1
+            if (self.expansion_cap is not None and D > 1
+                    and len(network) > self.expansion_cap):
+                self.capped.append((index, len(network)))
+                network = set(heapq.nsmallest(self.expansion_cap, network))
+        return network
+
+    def detect_anomaly(self, purchase_event, index):
+        """
+        Same as the anomaly check of process_event.
+
+        Returns
+        -------
+        anomaly: str
+            A string for the flagged anomaly purchase, empty if not flagged.
+        """
+        if not purchase_event['id'] in self.people_list.keys():
+            return {}
+        members = set()
+        candidate = {}
+        has_friend = False
+        for person_ID in self.frontier(purchase_event['id'], index):
+            person = self.people_list[person_ID]
+            if person.friend:
+                has_friend = True
+            if person_ID in self.hub_purchase:
+                for purchase in self.hub_purchase[person_ID]:
+                    candidate[purchase.index] = purchase
+            else:
+                members.update(person.friend)
+
+        # Skip the anomaly of purchase detection if the person has no
+        # friends.
+        if not has_friend:
+            return {}
+        for person_ID in members:
+            for purchase in self.people_list[person_ID].purchase[-self.T:]:
+                candidate[purchase.index] = purchase
+        T_purchase = heapq.nlargest(self.T, candidate.values(),
+                                    key=lambda x: x.index)
+        mean_amount, std_amount = mean_std(T_purchase)
+        # Only whether there are 2 purchases matters, and the candidates hold
+        # at least the latest T of them.
+        return flag_purchase(purchase_event, len(candidate), mean_amount,
+                             std_amount)
+
+    def process_event(self, event, index):
+        """
+        Same as anomaly_detection.process_event.
+        """
+        anomaly = {}
+        if event['event_type'] == 'purchase':
+            anomaly = self.detect_anomaly(event, index)
+        self.apply_event(event, index)
+        return anomaly
+
+    def browse_data(self, data, initial_order):
+        """
+        Same as anomaly_detection.browse_data.
+
+        Returns
+        -------
+        anomaly_list: list
+            The list of strings of flagged anomaly of purchases.
+        """
+        anomaly_list = []
+        for i in data:
+            anomaly = self.process_event(data[i], i + initial_order)
+            if anomaly:
+                anomaly_list.append(anomaly)
+        return anomaly_list
+
+    def report(self):
+        """
+        Summarize the hubs and the capped events.
+        """
+        return {'hubs': len(self.hub_purchase),
+                'capped_events': len(self.capped),
+                'largest_frontier': max([size for _, size in self.capped]
+                                        + [0])}
+
+def run(input_batch_log, input_stream_log, output, hub_degree=64,
+        expansion_cap=None):
+    """
+    Same as anomaly_detection.run, on a HubAwareEngine.
+
+    Returns
+    -------
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
+    D, T, test_data = read_json(input_batch_log)
+    _, _, test_update = read_json(input_stream_log)
+    if expansion_cap is not None:
+        expansion_cap = int(expansion_cap)
+    engine = HubAwareEngine(D, T, int(hub_degree), expansion_cap)
+    last_order = engine.build_history(test_data)
+    anomaly_list = engine.browse_data(test_update, last_order + 1)
+    if engine.capped:
+        sys.stderr.write('Capped networks: {}\n'.format(engine.report()))
+
+    with open(output, 'w') as result:
+        result.write('\n'.join(anomaly_list))
+    return anomaly_list
+
+def main():
+    run(*sys.argv[1:6])
+
+if __name__ == '__main__':
+    main()
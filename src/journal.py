@@ -0,0 +1,435 @@
+import hashlib
+import json
+import os
+import sys
+
+from anomaly_detection import (Person, apply_event, build_history,
+                               process_event, read_json)
+
+CHECKPOINT_FILE = 'checkpoint.json'
+JOURNAL_FILE = 'journal.log'
+
+class JournalError(Exception):
+    """
+    The journal directory does not belong to this run, or its journal does
+    not follow its checkpoint.
+    """
+    pass
+
+class Journal(object):
+    """
+    A Class, Journal.
+    An append-only log of streamed events and the flags they raised.
+
+    Each record is one line holding the index of the event in the stream, the
+    event, and its flag, so an event and its flag are always written together.
+    The first line is a header with the index of the last event of the
+    checkpoint the journal follows, so recover can tell a journal that does
+    not belong to its checkpoint. Records are fsynced in groups of commit_interval. Losing the records after
+    the last fsync is safe, because they are computed again from the stream.
+
+    Attributes
+    ----------
+    path: str
+        The path of the journal file.
+    commit_interval: int
+        The number of records written between two fsyncs.
+    pending: int
+        The number of records written since the last fsync.
+    """
+    def __init__(self, path, commit_interval=64):
+        self.path = path
+        self.commit_interval = max(1, commit_interval)
+        self.pending = 0
+        self.file = open(path, 'a')
+
+    def append(self, index, event, anomaly):
+        """
+        Append one record, and fsync if a group is complete.
+
+        Parameters
+        ----------
+        index: int
+            The index of the event in the stream.
+        event: dict
+            An event of 'purchase', 'befriend', or 'unfriend'.
+        anomaly: str
+            The flag raised by this event, empty if not flagged.
+        """
+        record = {'i': index, 'e': event, 'f': anomaly or None}
+        self.file.write(json.dumps(record) + '\n')
+        self.pending += 1
+        if self.pending >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        """
+        Flush the written records and fsync them to disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def reset(self, last):
+        """
+        Drop all records, once a checkpoint covers them.
+
+        Parameters
+        ----------
+        last: int
+            The index of the last event of that checkpoint.
+        """
+        self.file.close()
+        self.file = open(self.path, 'w')
+        self.file.write(json.dumps({'after': last}) + '\n')
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+def read_journal(path, repair=True):
+    """
+    Read the records of a journal, and cut off a torn record at its end.
+
+    Parameters
+    ----------
+    path: str
+        The path of the journal file.
+    repair: bool
+        Whether to truncate the torn record in the file too. Readers of a
+        journal that may still be written leave it alone.
+
+    Returns
+    -------
+    records: list
+        A list of records, as dictionaries of 'i', 'e', and 'f', after the
+        header, a dictionary of 'after'.
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    good = 0
+    with open(path, 'rb') as jf:
+        for line in jf:
+            # A line without newline or broken json is a crashed write.
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                break
+            good += len(line)
+    if repair and good < os.path.getsize(path):
+        with open(path, 'r+b') as jf:
+            jf.truncate(good)
+    return records
+
+def people_to_dict(people_list):
+    """
+    Convert people_list into plain data that json can store.
+
+    Parameters
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+
+    Returns
+    -------
+    people: dict
+        key: A string for Person's ID
+        value: A dictionary of 'friend' and 'purchase'.
+    """
+    people = {}
+    for person_ID, person in people_list.items():
+        people[person_ID] = {
+            'friend': sorted(person.friend),
+            'purchase': [[p.amount, p.timestamp, p.index]
+                         for p in person.purchase]}
+    return people
+
+def people_from_dict(people):
+    """
+    Rebuild people_list from the plain data of people_to_dict.
+
+    Parameters
+    ----------
+    people: dict
+        key: A string for Person's ID
+        value: A dictionary of 'friend' and 'purchase'.
+
+    Returns
+    -------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    """
+    people_list = {}
+    for person_ID, info in people.items():
+        person = Person(person_ID)
+        person.friend = set(info['friend'])
+        for amount, timestamp, index in info['purchase']:
+            person.add_purchase({'amount': amount, 'timestamp': timestamp},
+                                index)
+        people_list[person_ID] = person
+    return people_list
+
+def save_checkpoint(path, state):
+    """
+    Write a checkpoint atomically, so a crash leaves the old or the new one.
+
+    Parameters
+    ----------
+    path: str
+        The path of the checkpoint file.
+    state: dict
+        The json-ready state to store.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as cf:
+        json.dump(state, cf)
+        cf.flush()
+        os.fsync(cf.fileno())
+    os.replace(tmp_path, path)
+
+    # Make the rename itself durable.
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by save_checkpoint.
+
+    Parameters
+    ----------
+    path: str
+        The path of the checkpoint file.
+
+    Returns
+    -------
+    state: dict
+        The stored state, or None if there is no checkpoint.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as cf:
+        return json.load(cf)
+
+def recover(journal_dir, repair=True):
+    """
+    Reload the newest checkpoint and replay the journal tail after it.
+
+    Parameters
+    ----------
+    journal_dir: str
+        The directory of the checkpoint and journal files.
+    repair: bool
+        Whether to truncate a torn record at the end of the journal.
+
+    Returns
+    -------
+    state: dict
+        key: 'D', 'T', 'initial_order', 'last', 'people_list', 'flags',
+        'inputs', and 'complete'. 'last' is the index of the last streamed
+        event already applied. None if there is no checkpoint.
+
+    Raises
+    ------
+    JournalError
+        If the journal was started after a newer checkpoint, or skips an
+        event.
+    """
+    checkpoint = load_checkpoint(os.path.join(journal_dir, CHECKPOINT_FILE))
+    if checkpoint is None:
+        return None
+    people_list = people_from_dict(checkpoint['people'])
+    flags = checkpoint['flags']
+    last = checkpoint['last']
+    initial_order = checkpoint['initial_order']
+
+    records = read_journal(os.path.join(journal_dir, JOURNAL_FILE), repair)
+    if records:
+        after = records[0].get('after')
+        # A journal started after an older checkpoint is left over from a
+        # crash between writing the checkpoint and resetting the journal.
+        if after is None or after > last:
+            raise JournalError('The journal of {} does not follow its '
+                               'checkpoint'.format(journal_dir))
+        expected = after + 1
+        for record in records[1:]:
+            if record['i'] != expected:
+                raise JournalError('The journal of {} skips from event {} '
+                                   'to {}'.format(journal_dir, expected - 1,
+                                                  record['i']))
+            expected += 1
+            if record['i'] <= last:
+                continue
+            apply_event(people_list, record['e'], record['i'] + initial_order)
+            if record['f']:
+                flags.append(record['f'])
+            last = record['i']
+    return {'D': checkpoint['D'], 'T': checkpoint['T'],
+            'initial_order': initial_order, 'last': last,
+            'people_list': people_list, 'flags': flags,
+            'inputs': checkpoint.get('inputs'),
+            'complete': checkpoint.get('complete', False)}
+
+def checkpoint_state(D, T, initial_order, last, people_list, flags,
+                     inputs=None, complete=False):
+    """
+    Pack the in-memory state into the json-ready form of a checkpoint.
+    """
+    return {'D': D, 'T': T, 'initial_order': initial_order, 'last': last,
+            'people': people_to_dict(people_list), 'flags': flags,
+            'inputs': inputs, 'complete': complete}
+
+def file_identity(path):
+    """
+    Identify an input file by its path, size and content hash.
+
+    Returns
+    -------
+    identity: dict
+        key: 'path', 'size', and 'sha1'.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return {'path': os.path.abspath(path), 'size': os.path.getsize(path),
+            'sha1': digest.hexdigest()}
+
+def journaled_browse(people_list, data, D, T, initial_order, journal_dir,
+                     commit_interval=64, checkpoint_interval=10000,
+                     inputs=None):
+    """
+    Same as browse_data, but every event is journaled and the state is
+    checkpointed, so a crashed run resumes where it stopped.
+
+    If journal_dir holds the checkpoint of an unfinished run, people_list, D,
+    T and initial_order are taken from it instead, and the events of data
+    that were already applied are skipped. A finished run marks its last
+    checkpoint complete, so the next run in journal_dir starts over.
+
+    Parameters
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    data: dict
+        key: An integer for the index of events.
+        value: An event.
+    D: int
+        The number of degree in social network.
+    T: int
+        The number of purchases that we want to track.
+    initial_order: int
+        The index of the first streamed event after the batch.
+    journal_dir: str
+        The directory of the checkpoint and journal files.
+    commit_interval: int
+        The number of journal records between two fsyncs.
+    checkpoint_interval: int
+        The number of events between two checkpoints.
+    inputs: dict
+        Json-ready identity of the input files, stored in checkpoints. None
+        to not check it.
+
+    Returns
+    -------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+
+    Raises
+    ------
+    JournalError
+        If journal_dir holds an unfinished run of other inputs, or a journal
+        that does not follow its checkpoint.
+    """
+    assert D >=1, 'Please enter value >= 1 for D'
+    assert T >= 2, 'Please enter value >= 2 for T'
+    if not os.path.isdir(journal_dir):
+        os.makedirs(journal_dir)
+    checkpoint_path = os.path.join(journal_dir, CHECKPOINT_FILE)
+
+    state = recover(journal_dir)
+    if state is None or state['complete']:
+        last = -1
+        anomaly_list = []
+    else:
+        if inputs is not None and state['inputs'] != inputs:
+            raise JournalError('{} holds an unfinished run of other inputs'
+                               .format(journal_dir))
+        D, T = state['D'], state['T']
+        initial_order, last = state['initial_order'], state['last']
+        people_list, anomaly_list = state['people_list'], state['flags']
+
+    journal = Journal(os.path.join(journal_dir, JOURNAL_FILE), commit_interval)
+    # Start a fresh journal after the state recovered above.
+    save_checkpoint(checkpoint_path, checkpoint_state(
+        D, T, initial_order, last, people_list, anomaly_list, inputs))
+    journal.reset(last)
+    since_checkpoint = 0
+    for i in data:
+        if i <= last:
+            continue
+        anomaly = process_event(people_list, data[i], i + initial_order, D, T)
+        journal.append(i, data[i], anomaly)
+        if anomaly:
+            anomaly_list.append(anomaly)
+        last = i
+        since_checkpoint += 1
+        if since_checkpoint >= checkpoint_interval:
+            save_checkpoint(checkpoint_path, checkpoint_state(
+                D, T, initial_order, last, people_list, anomaly_list, inputs))
+            journal.reset(last)
+            since_checkpoint = 0
+    save_checkpoint(checkpoint_path, checkpoint_state(
+        D, T, initial_order, last, people_list, anomaly_list, inputs, True))
+    journal.reset(last)
+    journal.close()
+    return people_list, anomaly_list
+
+def run(input_batch_log, input_stream_log, output, journal_dir,
+        commit_interval=64, checkpoint_interval=10000):
+    """
+    Same as anomaly_detection.run, but streams through journaled_browse.
+    The intervals may be given as strings, as they come from the command line.
+
+    Returns
+    -------
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
+    inputs = {'batch': file_identity(input_batch_log),
+              'stream': file_identity(input_stream_log)}
+    _, _, test_update = read_json(input_stream_log)
+
+    # The batch is only needed when there is no unfinished run to resume.
+    checkpoint = load_checkpoint(os.path.join(journal_dir, CHECKPOINT_FILE))
+    if checkpoint is not None and not checkpoint.get('complete', False):
+        people_list, D, T, last_order = {}, 1, 2, -1
+    else:
+        D, T, test_data = read_json(input_batch_log)
+        people_list, last_order = build_history(test_data)
+
+    _, anomaly_list = journaled_browse(
+        people_list, test_update, D, T, last_order + 1, journal_dir,
+        int(commit_interval), int(checkpoint_interval), inputs)
+
+    with open(output, 'w') as result:
+        result.write('\n'.join(anomaly_list))
+    return anomaly_list
+
+def main():
+    run(*sys.argv[1:7])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+import heapq
+import multiprocessing
+import resource
+import sys
+import zlib
+
+from anomaly_detection import (Person, Purchase, flag_purchase, mean_std,
+                               read_json)
+
+# build_history sends the routed events every FLUSH_EVERY events, so the
+# shards apply them while the rest is routed, and the outbox stays small.
+FLUSH_EVERY = 10000
+
+def shard_worker(connection):
+    """
+    Own the people of one shard, and answer the coordinator through a pipe.
+
+    Commands are (name, payload) tuples. 'apply' has no reply, so the
+    coordinator can send events without waiting; a pipe keeps their order, so
+    any later query sees them.
+
+    Parameters
+    ----------
+    connection: multiprocessing.connection.Connection
+        The end of the pipe of this shard.
+    """
+    people_list = {}
+    while True:
+        command, payload = connection.recv()
+        if command == 'apply':
+            for operation, person_ID, event, index in payload:
+                if operation == 'unfriend':
+                    # Same as build_history, for missing befriend events.
+                    try:
+                        people_list[person_ID].delete_friend(event)
+                    except:
+                        pass
+                    continue
+                if not person_ID in people_list.keys():
+                    people_list[person_ID] = Person(person_ID)
+                if operation == 'purchase':
+                    people_list[person_ID].add_purchase(event, index)
+                else:
+                    people_list[person_ID].add_friend(event)
+        elif command == 'friends':
+            if payload in people_list.keys():
+                connection.send(people_list[payload].friend)
+            else:
+                connection.send(None)
+        elif command == 'expand':
+            network = set()
+            for person_ID in payload:
+                network.update(people_list[person_ID].friend)
+            connection.send(network)
+        elif command == 'top':
+            network, T = payload
+            count = 0
+            candidate = []
+            for person_ID in network:
+                purchase = people_list[person_ID].purchase
+                count += len(purchase)
+                # A person's purchases are in order, so older ones than the
+                # latest T can not be in the latest T of the network.
+                candidate.extend((p.index, p.amount) for p in purchase[-T:])
+            connection.send((count, heapq.nlargest(T, candidate)))
+        elif command == 'size':
+            connection.send(len(people_list))
+        elif command == 'memory':
+            connection.send(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        else:  # for stop
+            connection.close()
+            return
+
+def hash_partition(person_ID, num_shards):
+    """
+    Assign a person to a shard by a hash of the id, which is the same in
+    every process.
+
+    Parameters
+    ----------
+    person_ID: str
+        Person's id.
+    num_shards: int
+        The number of shards.
+
+    Returns
+    -------
+    shard: int
+        The index of the shard.
+    """
+    return zlib.crc32(person_ID.encode('utf-8')) % num_shards
+
+def community_partition(data, num_shards, slack=1.1):
+    """
+    Assign people of the batch to shards so that friends tend to share a
+    shard, by linear deterministic greedy streaming partitioning.
+
+    Every person goes to the shard that holds most of their already assigned
+    friends, weighted by how much room the shard has left.
+
+    Parameters
+    ----------
+    data: dict
+        key: An integer for the index of events.
+        value: An event.
+    num_shards: int
+        The number of shards.
+    slack: float
+        How much larger than an even share a shard may grow.
+
+    Returns
+    -------
+    partition: dict
+        key: A string for Person's ID
+        value: The index of the shard.
+    """
+    friend = {}
+    for i in data:
+        event = data[i]
+        if event['event_type'] == 'purchase':
+            friend.setdefault(event['id'], set())
+        elif event['event_type'] == 'befriend':
+            friend.setdefault(event['id1'], set()).add(event['id2'])
+            friend.setdefault(event['id2'], set()).add(event['id1'])
+
+    capacity = slack * len(friend) / num_shards + 1
+    size = [0] * num_shards
+    partition = {}
+    for person_ID in friend:
+        score = [0] * num_shards
+        for friend_ID in friend[person_ID]:
+            if friend_ID in partition:
+                score[partition[friend_ID]] += 1
+        best = max(range(num_shards), key=lambda shard: (
+            score[shard] * (1 - size[shard] / capacity), -size[shard]))
+        partition[person_ID] = best
+        size[best] += 1
+    return partition
+
+class ShardedGraph(object):
+    """
+    A Class, ShardedGraph.
+    people_list split across shard worker processes.
+
+    Each shard owns the friend sets and purchases of its people. Events are
+    routed to the shards of the people they touch, friend_network exchanges
+    frontiers with the shards level by level, and the statistics merge the
+    latest T purchases of every shard.
+
+    Attributes
+    ----------
+    num_shards: int
+        The number of shard worker processes.
+    partition: dict
+        key: A string for Person's ID
+        value: The index of the shard. People not in it are hashed.
+    """
+    def __init__(self, num_shards, partition=None):
+        self.num_shards = num_shards
+        self.partition = partition or {}
+        self.connections = []
+        self.processes = []
+        self.outbox = [[] for _ in range(num_shards)]
+        for _ in range(num_shards):
+            connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=shard_worker, args=(child_connection,), daemon=True)
+            process.start()
+            child_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def owner(self, person_ID):
+        if person_ID in self.partition:
+            return self.partition[person_ID]
+        return hash_partition(person_ID, self.num_shards)
+
+    def apply(self, event, index):
+        """
+        Route one event to the shards of the people it touches.
+
+        Parameters
+        ----------
+        event: dict
+            An event of 'purchase', 'befriend', or 'unfriend'.
+        index: int
+            The index of the event in the data. The lower the earlier.
+        """
+        if event['event_type'] == 'purchase':
+            self.outbox[self.owner(event['id'])].append(
+                ('purchase', event['id'], event, index))
+        else:
+            for person_ID in (event['id1'], event['id2']):
+                self.outbox[self.owner(person_ID)].append(
+                    (event['event_type'], person_ID, event, index))
+
+    def flush(self):
+        """
+        Send the routed events that have not been sent yet.
+        """
+        for shard in range(self.num_shards):
+            if self.outbox[shard]:
+                self.connections[shard].send(('apply', self.outbox[shard]))
+                self.outbox[shard] = []
+
+    def ask(self, command, payload_by_shard):
+        """
+        Send one command to several shards at once, and gather the replies.
+
+        Parameters
+        ----------
+        command: str
+            The name of the command.
+        payload_by_shard: dict
+            key: The index of the shard.
+            value: The payload for that shard.
+
+        Returns
+        -------
+        replies: dict
+            key: The index of the shard.
+            value: The reply of that shard.
+        """
+        self.flush()
+        for shard, payload in payload_by_shard.items():
+            self.connections[shard].send((command, payload))
+        return dict((shard, self.connections[shard].recv())
+                    for shard in payload_by_shard)
+
+    def split(self, network):
+        """
+        Group ids by the shard that owns them.
+        """
+        payload_by_shard = {}
+        for person_ID in network:
+            payload_by_shard.setdefault(self.owner(person_ID), []).append(
+                person_ID)
+        return payload_by_shard
+
+    def friend_network(self, person_ID, D):
+        """
+        Same as anomaly_detection.friend_network, with one exchange of
+        frontiers with the shards per degree.
+
+        Parameters
+        ----------
+        person_ID: str
+            Person's id.
+        D: int
+            The number of degree of social network
+
+        Returns
+        -------
+        network: set
+            The set of person's friends within D degree of social networks,
+            or None if the person is unknown.
+        """
+        owner = self.owner(person_ID)
+        network = self.ask('friends', {owner: person_ID})[owner]
+        if network is None:
+            return None
+        while D > 1:
+            replies = self.ask('expand', self.split(network))
+            network = set()
+            for reply in replies.values():
+                network.update(reply)
+            D -= 1
+        return network
+
+    def statistic_calculation(self, total_network, T):
+        """
+        Same as anomaly_detection.statistic_calculation, merging the latest T
+        purchases of every shard.
+
+        Returns
+        -------
+        num_purchase: int
+            The total number of purchases within social network.
+        mean_amount: float
+            The mean of at most T latest purchases.
+        std_amount: float
+            The standard deviation of at most T latest purchases.
+        """
+        payload_by_shard = dict((shard, (network, T)) for shard, network
+                                in self.split(total_network).items())
+        num_purchase = 0
+        candidate = []
+        for count, top in self.ask('top', payload_by_shard).values():
+            num_purchase += count
+            candidate.extend(top)
+        T_purchase = [Purchase(amount, None, index) for index, amount
+                      in heapq.nlargest(T, candidate)]
+        mean_amount, std_amount = mean_std(T_purchase)
+        return num_purchase, mean_amount, std_amount
+
+    def process_event(self, event, index, D, T):
+        """
+        Same as anomaly_detection.process_event, on the shards.
+        """
+        anomaly = {}
+        if event['event_type'] == 'purchase':
+            total_network = self.friend_network(event['id'], D)
+
+            # Skip the anomaly of purchase detection if the person is new or
+            # has no friends.
+            if total_network:
+                anomaly = flag_purchase(
+                    event, *self.statistic_calculation(total_network, T))
+        self.apply(event, index)
+        return anomaly
+
+    def build_history(self, data, flush_every=FLUSH_EVERY):
+        """
+        Same as anomaly_detection.build_history, on the shards.
+
+        Parameters
+        ----------
+        data: dict
+            key: The index of the event.
+            value: An event.
+        flush_every: int
+            The number of events routed between two sends to the shards.
+
+        Returns
+        -------
+        last_order: int
+            The index of the last event.
+        """
+        last_order = 0
+        for count, i in enumerate(data, 1):
+            last_order = i
+            self.apply(data[i], i)
+            if count % flush_every == 0:
+                self.flush()
+        self.flush()
+        return last_order
+
+    def browse_data(self, data, D, T, initial_order):
+        """
+        Same as anomaly_detection.browse_data, on the shards.
+
+        Returns
+        -------
+        anomaly_list: list
+            The list of strings of flagged anomaly of purchases.
+        """
+        assert D >=1, 'Please enter value >= 1 for D'
+        assert T >= 2, 'Please enter value >= 2 for T'
+        anomaly_list = []
+        for i in data:
+            anomaly = self.process_event(data[i], i + initial_order, D, T)
+            if anomaly:
+                anomaly_list.append(anomaly)
+        self.flush()
+        return anomaly_list
+
+    def sizes(self):
+        """
+        The number of people each shard owns.
+        """
+        replies = self.ask('size', dict((shard, None)
+                                        for shard in range(self.num_shards)))
+        return [replies[shard] for shard in range(self.num_shards)]
+
+    def memory(self):
+        """
+        The peak resident memory of each shard process, in megabytes.
+        """
+        replies = self.ask('memory', dict((shard, None)
+                                          for shard in range(self.num_shards)))
+        return [replies[shard] for shard in range(self.num_shards)]
+
+    def close(self):
+        self.flush()
+        for connection in self.connections:
+            connection.send(('stop', None))
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+def run(input_batch_log, input_stream_log, output, num_shards=4,
+        method='hash'):
+    """
+    Same as anomaly_detection.run, on a sharded graph.
+
+    Returns
+    -------
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
+    D, T, test_data = read_json(input_batch_log)
+    _, _, test_update = read_json(input_stream_log)
+    num_shards = int(num_shards)
+    partition = None
+    if method == 'community':
+        partition = community_partition(test_data, num_shards)
+
+    graph = ShardedGraph(num_shards, partition)
+    try:
+        last_order = graph.build_history(test_data)
+        anomaly_list = graph.browse_data(test_update, D, T, last_order + 1)
+    finally:
+        graph.close()
+
+    with open(output, 'w') as result:
+        result.write('\n'.join(anomaly_list))
+    return anomaly_list
+
+def main():
+    run(*sys.argv[1:6])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,562 @@
+import heapq
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from anomaly_detection import Purchase, flag_purchase, mean_std, read_json
+
+# Slots of the int64 header at the start of the segment.
+(EVENTS, PEOPLE, CAPACITY, EDGE_CAPACITY, T_SLOT, ID_BYTES, WRITER_PID,
+ EDGES_USED, PAUSE_UNTIL) = range(9)
+HEADER_BYTES = 128
+# How long a starved reader asks the writer to hold still, in nanoseconds.
+PAUSE_NS = 2000000
+# The number of friend slots of a person's first block. Each next block is
+# twice as large.
+FIRST_BLOCK = 4
+
+def block_slots(degree):
+    """
+    The friend slots used by all the blocks a person of degree friends had,
+    the full ones included.
+    """
+    used, size = 0, 0
+    while size < degree:
+        size = max(FIRST_BLOCK, 2 * size)
+        used += size
+    return used
+
+def layout(capacity, edge_capacity, T, id_bytes):
+    """
+    Compute where every array lives in the segment.
+
+    Parameters
+    ----------
+    capacity: int
+        The largest number of people.
+    edge_capacity: int
+        The number of friend slots in the pool of friend blocks.
+    T: int
+        The number of latest purchases kept per person.
+    id_bytes: int
+        The largest length of an id, in utf-8 bytes.
+
+    Returns
+    -------
+    offsets: dict
+        key: The name of an array.
+        value: (start, end) in bytes.
+    size: int
+        The size of the segment in bytes.
+    """
+    sizes = [('ids', capacity * id_bytes),
+             ('version', capacity * 8),
+             ('degree', capacity * 8),
+             ('block_start', capacity * 8),
+             ('block_size', capacity * 8),
+             ('friend', edge_capacity * 8),
+             ('count', capacity * 8),
+             ('amount', capacity * T * 8),
+             ('index', capacity * T * 8)]
+    offsets = {}
+    start = HEADER_BYTES
+    for name, size in sizes:
+        offsets[name] = (start, start + size)
+        # Keep every array aligned to 8 bytes.
+        start += (size + 7) // 8 * 8
+    return offsets, start
+
+class TornRead(Exception):
+    """
+    Raised when a reader finds a person in the middle of a change.
+    """
+    pass
+
+class SharedGraph(object):
+    """
+    A Class, SharedGraph.
+    The friends and latest purchases of people, in one shared memory segment.
+
+    People are stored in slots in the order they appear. Each slot has a
+    version, a block of friends in a shared pool, and a ring buffer of the
+    latest T purchases with the total number of purchases. Only the latest T
+    purchases of a person can be in the latest T of a network, so flags are
+    the same as with people_list.
+
+    A full block is copied into a block twice as large at the end of the
+    pool. Blocks are never reused, so a reader that still reads an old block
+    reads valid slots, and retries because the version changed. The pool
+    holds at most about four slots per friend link, and far less than rows
+    of the largest degree on graphs with a few people of many friends.
+
+    Attributes
+    ----------
+    shm: multiprocessing.shared_memory.SharedMemory
+        The segment.
+    capacity: int
+        The largest number of people.
+    edge_capacity: int
+        The number of friend slots in the pool.
+    T: int
+        The number of latest purchases kept per person.
+    slot: dict
+        key: A string for Person's ID
+        value: The slot of the person.
+    """
+    def attach(self, shm):
+        self.shm = shm
+        self.header = shm.buf[:HEADER_BYTES].cast('q')
+        self.capacity = self.header[CAPACITY]
+        self.edge_capacity = self.header[EDGE_CAPACITY]
+        self.T = self.header[T_SLOT]
+        self.id_bytes = self.header[ID_BYTES]
+        offsets, _ = layout(self.capacity, self.edge_capacity, self.T,
+                            self.id_bytes)
+        view = {}
+        for name, (start, end) in offsets.items():
+            view[name] = shm.buf[start:end]
+        self.ids = view['ids']
+        self.version = view['version'].cast('q')
+        self.degree = view['degree'].cast('q')
+        self.block_start = view['block_start'].cast('q')
+        self.block_size = view['block_size'].cast('q')
+        self.friend = view['friend'].cast('q')
+        self.count = view['count'].cast('q')
+        self.amount = view['amount'].cast('d')
+        self.index = view['index'].cast('q')
+        self.slot = {}
+
+    def observe(self, slot):
+        """
+        Called before reading the row or purchases of a slot. The writer
+        reads its own changes, so there is nothing to check.
+        """
+        pass
+
+    def friends(self, slot):
+        """
+        The slots of a person's direct friends.
+        """
+        self.observe(slot)
+        start = self.block_start[slot]
+        return self.friend[start:start + self.degree[slot]].tolist()
+
+    def friend_network(self, slot, D):
+        """
+        Same as anomaly_detection.friend_network, on slots.
+
+        Parameters
+        ----------
+        slot: int
+            The slot of the person.
+        D: int
+            The number of degree of social network
+
+        Returns
+        -------
+        network: set
+            The set of slots of friends within D degree of social networks.
+        """
+        network = set(self.friends(slot))
+        while D > 1:
+            whole_network = set()
+            for friend_slot in network:
+                whole_network.update(self.friends(friend_slot))
+            network = whole_network
+            D -= 1
+        return network
+
+    def statistic_calculation(self, total_network):
+        """
+        Same as anomaly_detection.statistic_calculation, on the ring buffers.
+
+        Returns
+        -------
+        num_purchase: int
+            The total number of purchases within social network.
+        mean_amount: float
+            The mean of at most T latest purchases.
+        std_amount: float
+            The standard deviation of at most T latest purchases.
+        """
+        num_purchase = 0
+        candidate = []
+        for slot in total_network:
+            self.observe(slot)
+            count = self.count[slot]
+            num_purchase += count
+            start = slot * self.T
+            for position in range(start, start + min(count, self.T)):
+                candidate.append((self.index[position],
+                                  self.amount[position]))
+        T_purchase = [Purchase(amount, None, index) for index, amount
+                      in heapq.nlargest(self.T, candidate)]
+        mean_amount, std_amount = mean_std(T_purchase)
+        return num_purchase, mean_amount, std_amount
+
+    def detect_anomaly(self, purchase_event, D):
+        """
+        Check a purchase against the network of its person, without adding
+        it.
+
+        Parameters
+        ----------
+        purchase_event: dict
+            key: A string of 'event_type', 'timestamp', 'id', and 'amount'.
+            value: A string.
+        D: int
+            The number of degree in social network.
+
+        Returns
+        -------
+        anomaly: str
+            A string for the flagged anomaly purchase, empty if not flagged.
+        """
+        slot = self.find(purchase_event['id'])
+        if slot is None:
+            return {}
+        total_network = self.friend_network(slot, D)
+
+        # Skip the anomaly of purchase detection if the person has no
+        # friends.
+        if len(total_network) == 0:
+            return {}
+        return flag_purchase(purchase_event,
+                             *self.statistic_calculation(total_network))
+
+    def find(self, person_ID):
+        return self.slot.get(person_ID)
+
+    def close(self):
+        """
+        Release the views, then detach from the segment.
+        """
+        for view in [self.header, self.ids, self.version, self.degree,
+                     self.block_start, self.block_size, self.friend,
+                     self.count, self.amount, self.index]:
+            view.release()
+        self.shm.close()
+
+class SharedGraphWriter(SharedGraph):
+    """
+    A Class, SharedGraphWriter.
+    The only process that changes a SharedGraph.
+
+    Every event increments the versions of the people it changes before and
+    after the change, so a version is odd while its person is changing.
+    Readers retry when a person they read was changing or changed while they
+    read, and never wait on changes to other people. A reader that retried
+    too often asks the writer to hold still for a moment before its next
+    event.
+    """
+    def __init__(self, capacity, edge_capacity, T, id_bytes=32, name=None):
+        offsets, size = layout(capacity, edge_capacity, T, id_bytes)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = shm.buf[:HEADER_BYTES].cast('q')
+        header[CAPACITY] = capacity
+        header[EDGE_CAPACITY] = edge_capacity
+        header[T_SLOT] = T
+        header[ID_BYTES] = id_bytes
+        header[WRITER_PID] = os.getpid()
+        header.release()
+        self.attach(shm)
+        self.name = shm.name
+        self.edges = set()
+
+    def add_person(self, person_ID):
+        """
+        Give a new person the next slot.
+        """
+        slot = self.header[PEOPLE]
+        if slot >= self.capacity:
+            raise ValueError('Shared graph is full: {} people'.format(slot))
+        encoded = person_ID.encode('utf-8')
+        if len(encoded) > self.id_bytes:
+            raise ValueError('Id is too long: {}'.format(person_ID))
+        start = slot * self.id_bytes
+        self.ids[start:start + len(encoded)] = encoded
+        self.slot[person_ID] = slot
+        # Publish the slot only after its id is written.
+        self.header[PEOPLE] = slot + 1
+        return slot
+
+    def ensure(self, person_ID):
+        slot = self.slot.get(person_ID)
+        if slot is None:
+            slot = self.add_person(person_ID)
+        return slot
+
+    def grow(self, slot):
+        """
+        Move a person's full block of friends into a new block twice as
+        large, at the end of the pool. Caller made the version odd.
+        """
+        degree = self.degree[slot]
+        size = max(FIRST_BLOCK, 2 * self.block_size[slot])
+        start = self.header[EDGES_USED]
+        if start + size > self.edge_capacity:
+            raise ValueError('Shared graph is out of friend slots: {}'.format(
+                self.edge_capacity))
+        old = self.block_start[slot]
+        self.friend[start:start + degree] = self.friend[old:old + degree]
+        self.header[EDGES_USED] = start + size
+        self.block_start[slot] = start
+        self.block_size[slot] = size
+
+    def add_friend(self, slot, friend_slot):
+        if (slot, friend_slot) in self.edges:
+            return
+        degree = self.degree[slot]
+        if degree == self.block_size[slot]:
+            self.grow(slot)
+        self.friend[self.block_start[slot] + degree] = friend_slot
+        self.degree[slot] = degree + 1
+        self.edges.add((slot, friend_slot))
+
+    def apply_event(self, event, index):
+        """
+        Same as anomaly_detection.apply_event, on the shared graph.
+
+        Unfriend events leave the graph as it is, the same as people_list,
+        where Person.delete_friend never removes a friend.
+        """
+        self.yield_to_readers()
+        if event['event_type'] == 'purchase':
+            changed = [self.ensure(event['id'])]
+        elif event['event_type'] == 'befriend':
+            changed = [self.ensure(event['id1']), self.ensure(event['id2'])]
+        else:
+            changed = []
+        changed = sorted(set(changed))
+        for slot in changed:
+            self.version[slot] += 1
+        try:
+            if event['event_type'] == 'purchase':
+                slot = changed[0]
+                count = self.count[slot]
+                position = slot * self.T + count % self.T
+                self.amount[position] = float(event['amount'])
+                self.index[position] = index
+                self.count[slot] = count + 1
+            elif event['event_type'] == 'befriend':
+                slot1 = self.slot[event['id1']]
+                slot2 = self.slot[event['id2']]
+                self.add_friend(slot1, slot2)
+                self.add_friend(slot2, slot1)
+        finally:
+            for slot in changed:
+                self.version[slot] += 1
+            self.header[EVENTS] += 1
+
+    def yield_to_readers(self):
+        """
+        Wait while a starved reader asked the writer to hold still.
+        """
+        delay = self.header[PAUSE_UNTIL] - time.monotonic_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+
+    def process_event(self, event, index, D):
+        """
+        Same as anomaly_detection.process_event, on the shared graph.
+        """
+        anomaly = {}
+        if event['event_type'] == 'purchase':
+            anomaly = self.detect_anomaly(event, D)
+        self.apply_event(event, index)
+        return anomaly
+
+    def build_history(self, data):
+        """
+        Same as anomaly_detection.build_history, on the shared graph.
+
+        Returns
+        -------
+        last_order: int
+            The index of the last event.
+        """
+        last_order = 0
+        for i in data:
+            last_order = i
+            self.apply_event(data[i], i)
+        return last_order
+
+    def browse_data(self, data, D, initial_order):
+        """
+        Same as anomaly_detection.browse_data, on the shared graph.
+
+        Returns
+        -------
+        anomaly_list: list
+            The list of strings of flagged anomaly of purchases.
+        """
+        assert D >=1, 'Please enter value >= 1 for D'
+        assert self.T >= 2, 'Please enter value >= 2 for T'
+        anomaly_list = []
+        for i in data:
+            anomaly = self.process_event(data[i], i + initial_order, D)
+            if anomaly:
+                anomaly_list.append(anomaly)
+        return anomaly_list
+
+    def unlink(self):
+        """
+        Detach from and remove the segment, once readers are done.
+        """
+        self.close()
+        self.shm.unlink()
+
+class SharedGraphReader(SharedGraph):
+    """
+    A Class, SharedGraphReader.
+    A process that reads a SharedGraph in place, while the writer changes it.
+
+    Attributes
+    ----------
+    max_retries: int
+        The number of retries of one read before asking the writer to hold
+        still.
+    retries: int
+        The number of reads that were repeated because the writer changed
+        people they read.
+    pauses: int
+        The number of times the writer was asked to hold still.
+    """
+    def __init__(self, name, max_retries=8):
+        shm = shared_memory.SharedMemory(name=name)
+        header = shm.buf[:HEADER_BYTES].cast('q')
+        writer_pid = header[WRITER_PID]
+        header.release()
+        # Only the writer may remove the segment. The writer and processes
+        # forked from it share one resource tracker, others must not track it.
+        if writer_pid not in (os.getpid(), os.getppid()):
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        self.attach(shm)
+        self.seen = {}
+        self.max_retries = max_retries
+        self.retries = 0
+        self.pauses = 0
+
+    def find(self, person_ID):
+        """
+        Look up a person's slot, reading the ids added since the last look.
+        Ids never change once their slot is published.
+        """
+        known = len(self.slot)
+        for slot in range(known, self.header[PEOPLE]):
+            start = slot * self.id_bytes
+            encoded = bytes(self.ids[start:start + self.id_bytes])
+            self.slot[encoded.rstrip(b'\0').decode('utf-8')] = slot
+        return self.slot.get(person_ID)
+
+    def observe(self, slot):
+        """
+        Remember the version of a slot before reading it.
+        """
+        version = self.version[slot]
+        if version % 2 or self.seen.get(slot, version) != version:
+            raise TornRead()
+        self.seen[slot] = version
+
+    def changed(self):
+        """
+        Whether any slot read since the last clean read has changed.
+        """
+        for slot, version in self.seen.items():
+            if self.version[slot] != version:
+                return True
+        return False
+
+    def read(self, function, *args):
+        """
+        Run a read-only function until no person it read changed meanwhile.
+        The result is then the one of the graph at the end of the read.
+        After max_retries, every retry first asks the writer to hold still,
+        so a read of many people finishes even against a busy writer.
+
+        Parameters
+        ----------
+        function: callable
+            A method of this reader that only reads the segment.
+
+        Returns
+        -------
+        result: object
+            The result of function.
+        """
+        attempts = 0
+        while True:
+            self.seen = {}
+            try:
+                result = function(*args)
+            except TornRead:
+                pass
+            except Exception:
+                # A torn read may look broken, only trust a clean one.
+                if not self.changed():
+                    raise
+            else:
+                if not self.changed():
+                    return result
+            self.retries += 1
+            attempts += 1
+            if attempts >= self.max_retries:
+                self.header[PAUSE_UNTIL] = time.monotonic_ns() + PAUSE_NS
+                self.pauses += 1
+
+    def detect(self, purchase_event, D):
+        """
+        Check a purchase against the current graph, as the writer would.
+        """
+        return self.read(self.detect_anomaly, purchase_event, D)
+
+def required_size(*datas):
+    """
+    Count the people, the friend slots of their blocks, and the longest id
+    in utf-8 bytes, which bound the capacity, edge_capacity and id_bytes of
+    a shared graph. Every befriend event is counted as a new friend.
+    """
+    befriend = {}
+    for data in datas:
+        for event in data.values():
+            if event['event_type'] == 'purchase':
+                befriend.setdefault(event['id'], 0)
+            else:
+                for person_ID in (event['id1'], event['id2']):
+                    befriend.setdefault(person_ID, 0)
+                    if event['event_type'] == 'befriend':
+                        befriend[person_ID] += 1
+    id_bytes = max([1] + [len(person_ID.encode('utf-8'))
+                          for person_ID in befriend])
+    edge_capacity = sum(block_slots(degree) for degree in befriend.values())
+    return max(1, len(befriend)), max(1, edge_capacity), id_bytes
+
+def run(input_batch_log, input_stream_log, output):
+    """
+    Same as anomaly_detection.run, on a shared graph.
+
+    Returns
+    -------
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    """
+    D, T, test_data = read_json(input_batch_log)
+    _, _, test_update = read_json(input_stream_log)
+    capacity, edge_capacity, id_bytes = required_size(test_data, test_update)
+    graph = SharedGraphWriter(capacity, edge_capacity, T, id_bytes)
+    try:
+        last_order = graph.build_history(test_data)
+        anomaly_list = graph.browse_data(test_update, D, last_order + 1)
+    finally:
+        graph.unlink()
+
+    with open(output, 'w') as result:
+        result.write('\n'.join(anomaly_list))
+    return anomaly_list
+
+def main():
+    run(sys.argv[1], sys.argv[2], sys.argv[3])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import json
+import random
+import sys
+
+def generate_events(num_events, num_people, seed=0, purchase_ratio=0.6,
+                    unfriend_ratio=0.05):
+    """
+    Generate a random sequence of events in the same shape as read_json.
+
+    Parameters
+    ----------
+    num_events: int
+        The number of events to generate.
+    num_people: int
+        The number of distinct ids to draw from.
+    seed: int
+        The seed of the random generator, so that runs can be repeated.
+    purchase_ratio: float
+        The share of purchase events. The rest are befriend or unfriend.
+    unfriend_ratio: float
+        The share of unfriend events.
+
+    Returns
+    -------
+    log_dict: dict
+        key: An integer for the index of events.
+        Value: A dictionary for events.
+    """
+    rng = random.Random(seed)
+    log_dict = {}
+    for index in range(num_events):
+        roll = rng.random()
+        if roll < purchase_ratio:
+            log_dict[index] = purchase_event(
+                rng, str(rng.randrange(num_people)), index)
+        else:
+            id1 = rng.randrange(num_people)
+            id2 = rng.randrange(num_people)
+            while id2 == id1 and num_people > 1:
+                id2 = rng.randrange(num_people)
+            if roll < purchase_ratio + unfriend_ratio:
+                event_type = 'unfriend'
+            else:
+                event_type = 'befriend'
+            log_dict[index] = {'event_type': event_type,
+                               'timestamp': timestamp(index),
+                               'id1': str(id1), 'id2': str(id2)}
+    return log_dict
+
+def generate_power_law_events(num_events, num_people, seed=0,
+                              purchase_ratio=0.6):
+    """
+    Generate a random sequence of events whose friendships grow by
+    preferential attachment, so that the number of friends follows a power
+    law and a few people become hubs.
+
+    Parameters
+    ----------
+    num_events: int
+        The number of events to generate.
+    num_people: int
+        The number of distinct ids to draw from.
+    seed: int
+        The seed of the random generator, so that runs can be repeated.
+    purchase_ratio: float
+        The share of purchase events. The rest are befriend events.
+
+    Returns
+    -------
+    log_dict: dict
+        key: An integer for the index of events.
+        Value: A dictionary for events.
+    """
+    rng = random.Random(seed)
+    log_dict = {}
+    # Both ids of every friendship, so that a uniform pick from it favors
+    # people with many friends.
+    endpoints = []
+    joined = 1
+    for index in range(num_events):
+        if rng.random() < purchase_ratio:
+            log_dict[index] = purchase_event(
+                rng, str(rng.randrange(joined)), index)
+            continue
+        if joined < num_people:
+            id1 = str(joined)
+            joined += 1
+        else:
+            id1 = str(rng.randrange(joined))
+        id2 = rng.choice(endpoints) if endpoints else '0'
+        while id2 == id1:
+            id2 = str(rng.randrange(joined))
+        endpoints.extend([id1, id2])
+        log_dict[index] = {'event_type': 'befriend',
+                           'timestamp': timestamp(index),
+                           'id1': id1, 'id2': id2}
+    return log_dict
+
+def purchase_event(rng, person_ID, index):
+    """
+    Generate a purchase event, which is sometimes much larger than usual.
+
+    Parameters
+    ----------
+    rng: random.Random
+        The random generator.
+    person_ID: str
+        The id of the person who made the purchase.
+    index: int
+        The index of the event.
+
+    Returns
+    -------
+    event: dict
+        key: A string of 'event_type', 'timestamp', 'id', and 'amount'.
+        value: A string.
+    """
+    amount = rng.lognormvariate(3, 0.5)
+    if rng.random() < 0.02:
+        amount *= 20
+    return {'event_type': 'purchase', 'timestamp': timestamp(index),
+            'id': person_ID, 'amount': '{:.2f}'.format(amount)}
+
+def timestamp(index):
+    """
+    Build a timestamp string that increases with index.
+
+    Parameters
+    ----------
+    index: int
+        The index of the event.
+
+    Returns
+    -------
+    timestamp: str
+        The time of the event.
+    """
+    minute, second = divmod(index, 60)
+    hour, minute = divmod(minute, 60)
+    return '2017-06-13 {:02d}:{:02d}:{:02d}'.format(hour % 24, minute, second)
+
+def write_log(file, log_dict, D=None, T=None):
+    """
+    Write events into a json file in the format read_json reads.
+
+    Parameters
+    ----------
+    file: str
+        The path of the json file.
+    log_dict: dict
+        key: An integer for the index of events.
+        Value: A dictionary for events.
+    D: int
+        Degree of social network, only written for batch logs.
+    T: int
+        Number of purchases, only written for batch logs.
+    """
+    with open(file, 'w') as jf:
+        if D is not None:
+            jf.write(json.dumps({'D': str(D), 'T': str(T)}) + '\n')
+        for index in log_dict:
+            jf.write(json.dumps(log_dict[index]) + '\n')
+
+def main():
+    output_batch_log = sys.argv[1]
+    output_stream_log = sys.argv[2]
+    num_batch = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    num_stream = int(sys.argv[4]) if len(sys.argv) > 4 else 10000
+    num_people = int(sys.argv[5]) if len(sys.argv) > 5 else 1000
+    events = generate_events(num_batch + num_stream, num_people)
+    write_log(output_batch_log,
+              dict((i, events[i]) for i in range(num_batch)), 2, 50)
+    write_log(output_stream_log,
+              dict((i, events[num_batch + i]) for i in range(num_stream)))
+
+if __name__ == '__main__':
+    main()
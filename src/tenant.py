@@ -0,0 +1,453 @@
+import argparse
+import collections
+import os
+import queue
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+from anomaly_detection import build_history, process_event, read_json
+from journal import (load_checkpoint, people_from_dict, people_to_dict,
+                     save_checkpoint)
+
+class Tenant(object):
+    """
+    A Class, Tenant.
+    One independent detection, with its own D, T, and people_list.
+
+    Attributes
+    ----------
+    ID: str
+        Tenant's id.
+    D: int
+        The number of degree in social network.
+    T: int
+        The number of purchases that we want to track.
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person. None while the tenant is evicted.
+    initial_order: int
+        The index of the first streamed event after the batch.
+    pending: collections.deque
+        Streamed events waiting to be processed, as (index, event).
+    anomaly_list: list
+        The list of strings of flagged anomaly of purchases.
+    links: int
+        About the number of friend links held in people_list.
+    purchases: int
+        The number of purchases held in people_list.
+    overfull: set
+        The ids of people with more than T purchases, which compact trims.
+    over_budget: bool
+        Whether the tenant held more than its budget after the last
+        compaction, because its friend links and latest T purchases alone do.
+    last_used: float
+        The time this tenant last processed events.
+    """
+    def __init__(self, ID, D, T, people_list, initial_order):
+        assert D >=1, 'Please enter value >= 1 for D'
+        assert T >= 2, 'Please enter value >= 2 for T'
+        self.ID = ID
+        self.D = D
+        self.T = T
+        self.initial_order = initial_order
+        self.pending = collections.deque()
+        self.anomaly_list = []
+        self.over_budget = False
+        self.load(people_list)
+        self.last_used = time.time()
+
+    @property
+    def size(self):
+        """
+        About the number of friend links and purchases held in people_list.
+        """
+        return self.links + self.purchases
+
+    def load(self, people_list):
+        """
+        Hold a people_list, and count what it holds.
+        """
+        self.links, self.purchases, self.overfull = footprint(people_list,
+                                                              self.T)
+        self.people_list = people_list
+
+    def process(self, quantum):
+        """
+        Process at most quantum pending events.
+
+        Parameters
+        ----------
+        quantum: int
+            The largest number of events to process in this turn.
+        """
+        for _ in range(min(quantum, len(self.pending))):
+            i, event = self.pending.popleft()
+            anomaly = process_event(self.people_list, event,
+                                    i + self.initial_order, self.D, self.T)
+            if anomaly:
+                self.anomaly_list.append(anomaly)
+            if event['event_type'] == 'purchase':
+                self.purchases += 1
+                if len(self.people_list[event['id']].purchase) > self.T:
+                    self.overfull.add(event['id'])
+            elif event['event_type'] == 'befriend':
+                self.links += 2
+        self.last_used = time.time()
+
+    def compact(self):
+        """
+        Keep only the latest T purchases of each person, visiting only the
+        people who have more.
+
+        The detection only looks at the latest T purchases of a network, and
+        older purchases of a person are never among them, so flags do not
+        change. Only the purchase count of a person is lost.
+        """
+        for person_ID in self.overfull:
+            purchase = self.people_list[person_ID].purchase
+            self.purchases -= len(purchase) - self.T
+            del purchase[:-self.T]
+        self.overfull.clear()
+
+def footprint(people_list, T):
+    """
+    Count the friend links and purchases held in people_list.
+
+    Parameters
+    ----------
+    people_list: dict
+        key: A string for Person's ID
+        value: A Person.
+    T: int
+        The number of purchases that we want to track.
+
+    Returns
+    -------
+    links: int
+        The number of friend links.
+    purchases: int
+        The number of purchases.
+    overfull: set
+        The ids of people with more than T purchases.
+    """
+    links, purchases = 0, 0
+    overfull = set()
+    for person_ID, person in people_list.items():
+        links += len(person.friend)
+        purchases += len(person.purchase)
+        if len(person.purchase) > T:
+            overfull.add(person_ID)
+    return links, purchases, overfull
+
+class PartitionedEngine(object):
+    """
+    A Class, PartitionedEngine.
+    Host many tenants in one process, and schedule their events fairly.
+
+    Tenants take turns of at most quantum events, so a tenant with a long
+    stream does not hold back the others. A tenant is processed, loaded or
+    evicted by at most one worker thread at a time, so its events keep their
+    order. The lock only guards the choice of that work, and snapshots are
+    written and read outside it, so one tenant's disk I/O does not stall the
+    workers of the others. Tenants that
+    grow over tenant_budget are compacted, and idle tenants are evicted to
+    snapshots while the resident tenants hold more than total_budget or once
+    they are idle for idle_timeout seconds.
+
+    Attributes
+    ----------
+    snapshot_dir: str
+        The directory of snapshots of evicted tenants.
+    tenant_budget: int
+        The number of friend links and purchases a tenant may hold before it
+        is compacted. None for no limit.
+    total_budget: int
+        The number of friend links and purchases all resident tenants may
+        hold. None for no limit.
+    idle_timeout: float
+        Seconds after which an idle tenant is evicted. None to never evict
+        for idleness.
+    quantum: int
+        The number of events a tenant processes in one turn.
+    workers: int
+        The number of worker threads.
+    tenants: dict
+        key: A string for Tenant's ID
+        value: A Tenant.
+    evictions: int
+        The number of times a tenant was evicted.
+    busy: set
+        The ids of tenants a worker is processing, loading or evicting.
+    evicting: set
+        The ids of busy tenants that are being written to snapshots.
+    """
+    def __init__(self, snapshot_dir, tenant_budget=None, total_budget=None,
+                 idle_timeout=None, quantum=100, workers=1):
+        if not os.path.isdir(snapshot_dir):
+            os.makedirs(snapshot_dir)
+        self.snapshot_dir = snapshot_dir
+        self.tenant_budget = tenant_budget
+        self.total_budget = total_budget
+        self.idle_timeout = idle_timeout
+        self.quantum = quantum
+        self.workers = workers
+        self.tenants = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+        self.busy = set()
+        self.evicting = set()
+
+    def add_tenant(self, tenant_ID, D, T, data):
+        """
+        Build a tenant's history from its batch events.
+
+        Parameters
+        ----------
+        tenant_ID: str
+            Tenant's id.
+        D: int
+            The number of degree in social network.
+        T: int
+            The number of purchases that we want to track.
+        data: dict
+            key: An integer for the index of events.
+            value: An event.
+        """
+        people_list, last_order = build_history(data)
+        tenant = Tenant(tenant_ID, D, T, people_list, last_order + 1)
+        self.enforce_budget(tenant)
+        with self.lock:
+            self.tenants[tenant_ID] = tenant
+            victims = self.evict_idle()
+        self.evict(victims)
+
+    def submit(self, tenant_ID, data):
+        """
+        Queue streamed events of a tenant.
+
+        Parameters
+        ----------
+        tenant_ID: str
+            Tenant's id.
+        data: dict
+            key: An integer for the index of events.
+            value: An event.
+        """
+        with self.lock:
+            self.tenants[tenant_ID].pending.extend(data.items())
+
+    def run(self):
+        """
+        Process all queued events of all tenants.
+
+        Returns
+        -------
+        anomaly: dict
+            key: A string for Tenant's ID
+            value: The list of strings of flagged anomaly of purchases.
+        """
+        ready = queue.Queue()
+        with self.lock:
+            for tenant_ID, tenant in self.tenants.items():
+                if tenant.pending:
+                    ready.put(tenant_ID)
+        remaining = [ready.qsize()]
+        errors = []
+
+        def work():
+            while True:
+                tenant_ID = ready.get()
+                if tenant_ID is None:
+                    return
+                tenant = self.tenants[tenant_ID]
+                try:
+                    self.acquire(tenant_ID)
+                    tenant.process(self.quantum)
+                    self.enforce_budget(tenant)
+                except Exception as error:
+                    errors.append(error)
+                    tenant.pending.clear()
+                with self.lock:
+                    self.release(tenant_ID)
+                    if tenant.pending:
+                        # Back of the line, after every other ready tenant.
+                        ready.put(tenant_ID)
+                    else:
+                        remaining[0] -= 1
+                        if remaining[0] == 0:
+                            for _ in range(self.workers):
+                                ready.put(None)
+                    victims = self.evict_idle()
+                try:
+                    self.evict(victims)
+                except Exception as error:
+                    errors.append(error)
+
+        if remaining[0] == 0:
+            return self.anomaly()
+        threads = [threading.Thread(target=work) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return self.anomaly()
+
+    def anomaly(self):
+        """
+        Collect the flagged purchases of every tenant.
+        """
+        return dict((tenant_ID, tenant.anomaly_list)
+                    for tenant_ID, tenant in self.tenants.items())
+
+    def acquire(self, tenant_ID):
+        """
+        Mark a tenant busy, once no other worker has it, and load it back from
+        its snapshot if evicted. The snapshot is read outside the lock.
+        """
+        with self.lock:
+            while tenant_ID in self.busy:
+                self.released.wait()
+            tenant = self.tenants[tenant_ID]
+            self.busy.add(tenant_ID)
+            if tenant.people_list is not None:
+                return tenant
+        state = load_checkpoint(self.snapshot_path(tenant_ID))
+        tenant.load(people_from_dict(state['people']))
+        return tenant
+
+    def release(self, tenant_ID):
+        """
+        Let other workers have a busy tenant. Caller holds the lock.
+        """
+        self.busy.discard(tenant_ID)
+        self.released.notify_all()
+
+    def snapshot_path(self, tenant_ID):
+        return os.path.join(self.snapshot_dir,
+                            '{}.json'.format(quote(tenant_ID, safe='')))
+
+    def enforce_budget(self, tenant):
+        """
+        Compact a tenant that holds more than tenant_budget, if it holds
+        purchases to trim. A tenant still over it is marked over_budget,
+        since only a larger budget helps. Caller has the tenant to itself,
+        busy or not yet added.
+        """
+        if self.tenant_budget is None or tenant.people_list is None:
+            return
+        if tenant.size > self.tenant_budget and tenant.overfull:
+            tenant.compact()
+        tenant.over_budget = tenant.size > self.tenant_budget
+
+    def over_budget(self):
+        """
+        The ids of tenants that hold more than tenant_budget even compacted.
+        """
+        return sorted(tenant_ID for tenant_ID, tenant in self.tenants.items()
+                      if tenant.over_budget)
+
+    def resident_size(self):
+        return sum(tenant.size for tenant in self.tenants.values()
+                   if tenant.people_list is not None
+                   and tenant.ID not in self.evicting)
+
+    def evict_idle(self):
+        """
+        Pick idle tenants to evict, least recently used first, while the
+        resident tenants are over total_budget, and any tenant idle for
+        longer than idle_timeout. Caller holds the lock, and passes the
+        victims to evict once it released it.
+
+        Returns
+        -------
+        victims: list
+            The picked tenants, marked busy.
+        """
+        idle = sorted((tenant for tenant in self.tenants.values()
+                       if tenant.people_list is not None
+                       and not tenant.pending
+                       and tenant.ID not in self.busy),
+                      key=lambda tenant: tenant.last_used)
+        now = time.time()
+        resident = self.resident_size()
+        victims = []
+        for tenant in idle:
+            over_budget = (self.total_budget is not None
+                           and resident > self.total_budget)
+            too_idle = (self.idle_timeout is not None
+                        and now - tenant.last_used > self.idle_timeout)
+            if over_budget or too_idle:
+                resident -= tenant.size
+                self.busy.add(tenant.ID)
+                self.evicting.add(tenant.ID)
+                victims.append(tenant)
+        return victims
+
+    def evict(self, victims):
+        """
+        Write the people_list of tenants picked by evict_idle to their
+        snapshots and drop them from memory, without holding the lock.
+        """
+        try:
+            for tenant in victims:
+                save_checkpoint(self.snapshot_path(tenant.ID),
+                                {'people': people_to_dict(tenant.people_list)})
+                tenant.people_list = None
+        finally:
+            with self.lock:
+                for tenant in victims:
+                    if tenant.people_list is None:
+                        self.evictions += 1
+                    self.evicting.discard(tenant.ID)
+                    self.release(tenant.ID)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the detection of many merchants in one process.')
+    parser.add_argument('snapshot_dir',
+                        help='directory of the snapshots of evicted merchants')
+    parser.add_argument('tenant_dirs', nargs='+',
+                        help='merchant directories, laid out like this '
+                             'repository')
+    parser.add_argument('--tenant-budget', type=int,
+                        help='friend links and purchases of one merchant '
+                             'before it is compacted')
+    parser.add_argument('--total-budget', type=int,
+                        help='friend links and purchases of all resident '
+                             'merchants before idle ones are evicted')
+    parser.add_argument('--idle-timeout', type=float,
+                        help='seconds after which an idle merchant is evicted')
+    parser.add_argument('--quantum', type=int, default=100,
+                        help='events a merchant processes in one turn')
+    parser.add_argument('--workers', type=int, default=1)
+    options = parser.parse_args()
+    tenant_dirs = options.tenant_dirs
+
+    engine = PartitionedEngine(
+        options.snapshot_dir, options.tenant_budget, options.total_budget,
+        options.idle_timeout, options.quantum, options.workers)
+    for tenant_dir in tenant_dirs:
+        D, T, test_data = read_json(
+            os.path.join(tenant_dir, 'log_input', 'batch_log.json'))
+        engine.add_tenant(tenant_dir, D, T, test_data)
+    for tenant_dir in tenant_dirs:
+        _, _, test_update = read_json(
+            os.path.join(tenant_dir, 'log_input', 'stream_log.json'))
+        engine.submit(tenant_dir, test_update)
+
+    anomaly = engine.run()
+    for tenant_dir in engine.over_budget():
+        sys.stderr.write('{} is over its budget with only the latest T '
+                         'purchases kept\n'.format(tenant_dir))
+    for tenant_dir, anomaly_list in anomaly.items():
+        with open(os.path.join(tenant_dir, 'log_output',
+                               'flagged_purchases.json'), 'w') as result:
+            result.write('\n'.join(anomaly_list))
+
+if __name__ == '__main__':
+    main()
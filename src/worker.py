@@ -0,0 +1,199 @@
+import importlib
+import json
+import os
+import socket
+import sys
+import time
+
+# Backends are only imported by the first request that asks for them, so a
+# worker serving plain requests never pays for the others.
+BACKENDS = {
+    'plain': 'anomaly_detection',
+    'journal': 'journal',
+    'hubs': 'hubs',
+    'shard': 'shard',
+    'shared': 'shared_store',
+}
+
+def load_backend(name):
+    """
+    Import the module of a backend on first use.
+
+    Parameters
+    ----------
+    name: str
+        The name of the backend in BACKENDS.
+
+    Returns
+    -------
+    module: module
+        The module, which has a run function.
+    """
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend: {}'.format(name))
+    return importlib.import_module(BACKENDS[name])
+
+def handle(request):
+    """
+    Run one request.
+
+    Parameters
+    ----------
+    request: dict
+        key: 'backend' (default 'plain'), and 'args', the list of arguments of
+        the run function of the backend.
+
+    Returns
+    -------
+    response: dict
+        key: 'flags' and 'seconds', or 'error' if the request failed.
+    """
+    start = time.perf_counter()
+    try:
+        backend = load_backend(request.get('backend', 'plain'))
+        anomaly_list = backend.run(*request['args'])
+    except Exception as error:
+        return {'error': '{}: {}'.format(type(error).__name__, error)}
+    return {'flags': len(anomaly_list),
+            'seconds': time.perf_counter() - start}
+
+def parse_request(line):
+    """
+    Read one request line.
+
+    Parameters
+    ----------
+    line: bytes
+        The json line sent by a client.
+
+    Returns
+    -------
+    request: dict
+        The request, as described in handle.
+
+    Raises
+    ------
+    ValueError
+        If the line is not a json object.
+    """
+    request = json.loads(line.decode('utf-8'))
+    if not isinstance(request, dict):
+        raise ValueError('A request must be a json object')
+    return request
+
+def remove_stale_socket(socket_path):
+    """
+    Remove the socket file left by a killed worker, so a new one can bind.
+    A socket that still accepts connections belongs to a live worker and is
+    left alone.
+    """
+    if not os.path.exists(socket_path):
+        return
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except ConnectionRefusedError:
+        os.unlink(socket_path)
+    except OSError:
+        # Not a socket, which bind reports below.
+        pass
+    finally:
+        client.close()
+
+def serve(socket_path, timeout=5):
+    """
+    Keep one warm process and run requests sent through a local socket, one
+    json line per connection, until a request of {"command": "stop"}.
+
+    Parameters
+    ----------
+    socket_path: str
+        The path of the unix socket to listen on.
+    timeout: float
+        The seconds a client has to send its request line, and to read the
+        response. Requests are served one at a time, so a client that never
+        finishes its line gets an error instead of holding back the others.
+    """
+    remove_stale_socket(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(16)
+    try:
+        while True:
+            connection, _ = server.accept()
+            connection.settimeout(timeout)
+            with connection, connection.makefile('rwb') as stream:
+                try:
+                    line = stream.readline()
+                except socket.timeout:
+                    line = None
+                    response = {'error': 'timeout: no request line within '
+                                         '{} seconds'.format(timeout)}
+                if line == b'':
+                    continue
+                if line is not None:
+                    try:
+                        request = parse_request(line)
+                    except ValueError as error:
+                        response = {'error': '{}: {}'.format(
+                            type(error).__name__, error)}
+                    else:
+                        if request.get('command') == 'stop':
+                            stream.write(b'{"stopped": true}\n')
+                            break
+                        response = handle(request)
+                try:
+                    stream.write(
+                        (json.dumps(response) + '\n').encode('utf-8'))
+                    stream.flush()
+                except OSError:
+                    # The client left or stopped reading; serve the next one.
+                    pass
+    finally:
+        server.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+
+def submit(socket_path, request):
+    """
+    Send one request to a running worker and wait for its response.
+
+    Parameters
+    ----------
+    socket_path: str
+        The path of the unix socket the worker listens on.
+    request: dict
+        The request, as described in handle.
+
+    Returns
+    -------
+    response: dict
+        The response of the worker.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    with client, client.makefile('rwb') as stream:
+        stream.write((json.dumps(request) + '\n').encode('utf-8'))
+        stream.flush()
+        return json.loads(stream.readline().decode('utf-8'))
+
+def main():
+    command = sys.argv[1]
+    socket_path = sys.argv[2]
+    if command == 'serve':
+        # serve SOCKET [TIMEOUT]
+        serve(socket_path, *map(float, sys.argv[3:4]))
+    elif command == 'stop':
+        print(json.dumps(submit(socket_path, {'command': 'stop'})))
+    else:
+        # For example: submit SOCKET plain BATCH STREAM OUTPUT
+        response = submit(socket_path,
+                          {'backend': sys.argv[3], 'args': sys.argv[4:]})
+        print(json.dumps(response))
+        if 'error' in response:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()